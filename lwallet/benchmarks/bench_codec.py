@@ -0,0 +1,49 @@
+#!/usr/bin/env python3.7
+
+# Throughput of the hex codec on 100 KB, against the old per-byte
+# conversions, for plain bytes and for decoding a transaction from hex.
+#
+#   bench_codec.py [kilobytes]
+
+import os
+
+import common
+
+from lwallet import codec, serialize
+from lwallet.Transaction import CTransaction, CTxIn, CTxOut, COutPoint
+
+size = common.arg(1, 100) * 1000
+
+# what serialize, ledger, Masternode and address each had
+def old_b2hs(b):
+    return u''.join([u'%2.2x' % c for c in b])
+
+def old_hs2b(hs):
+    return bytes([int(hs[x:x + 2], 16) for x in range(0, len(hs), 2)])
+
+def old_b2s(b):
+    return u''.join([u'%c' % c for c in b])
+
+b = os.urandom(size)
+hs = codec.b2hs(b)
+
+# a transaction of about the same size
+tx = CTransaction()
+while len(tx.serialize()) < size:
+    tx.vin.append(CTxIn(COutPoint(os.urandom(32), 0), os.urandom(107), 0xffffffff))
+    tx.vout.append(CTxOut(1000, os.urandom(25)))
+tx_hs = codec.b2hs(tx.serialize())
+
+def decode_tx(hs2b):
+    return lambda: CTransaction().deserialize(serialize.ByteReader(hs2b(tx_hs)))
+
+rows = []
+for name, before, after, n in (('b2hs', lambda: old_b2hs(b), lambda: codec.b2hs(b), size),
+                               ('hs2b', lambda: old_hs2b(hs), lambda: codec.hs2b(hs), size),
+                               ('b2s', lambda: old_b2s(b), lambda: codec.b2s(b), size),
+                               ('transaction from hex', decode_tx(old_hs2b), decode_tx(codec.hs2b), len(tx_hs) // 2)):
+    t0 = common.timed(before)
+    t1 = common.timed(after)
+    rows.append((name, '%.1f' % (n / t0 / 1e6), '%.1f' % (n / t1 / 1e6), '%.0fx' % (t0 / t1)))
+
+common.report('codec: %d KB' % (size // 1000), ('', 'before MB/s', 'after MB/s', 'speedup'), rows)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3.7
+
+# APDUs per second signing a 20-input transaction on the emulator, with
+# the shared dongle session against the old new session per APDU.  The
+# emulator opens instantly, so opening a session is charged open_cost
+# seconds (HID enumeration on a real device) and every APDU latency.
+#
+#   bench_ledger.py [inputs] [open_cost] [latency]
+
+import contextlib
+import io
+import os
+import random
+import time
+
+import common
+
+os.environ['LWALLET_EMULATOR'] = '1'
+
+from coinapi import eelocal as eel
+from lwallet import emulator, energi, ledger, script, serialize, txcache, Transaction
+from lwallet.Transaction import CTransaction, CTxIn, CTxOut, COutPoint
+
+nin = common.arg(1, 20)
+open_cost = common.arg(2, 0.01)
+latency = common.arg(3, 0.001)
+
+# one device; its state outlives any session, as on the real thing
+device = emulator.Emulator(latency = latency)
+opens = [0]
+def open_device():
+    opens[0] += 1
+    time.sleep(open_cost)
+    return device
+ledger._open = open_device
+
+r = random.Random(1)
+address_d = {}
+prev_d = {}
+tx = CTransaction()
+for i in range(nin):
+    ae = energi.create_pathd(index = i)
+    ae['public_key'] = ledger.get_public_key(energi.serialize_pathd(ae))
+    a = energi.encode_address(energi.compress_public_key(ae['public_key']))
+    address_d[a] = ae
+
+    p = CTransaction()
+    p.vin.append(CTxIn(COutPoint(bytes(r.randrange(256) for _ in range(32)), 0), bytes(107), 0xffffffff))
+    p.vout.append(CTxOut(100000, script.standard_p2pkh_pkh(energi.decode_address(a))))
+    raw = p.serialize()
+    txid = serialize.b2hs(Transaction.hash256(raw)[::-1])
+    prev_d[txid] = serialize.b2hs(raw)
+    tx.vin.append(CTxIn(COutPoint(serialize.hs2b(txid), 0), b'', 0xffffffff))
+tx.vout.append(CTxOut(100000 * nin - 10000, script.standard_p2pkh_pkh(bytes(20))))
+
+eel.get_hex_transaction = lambda txid: prev_d[txid]
+eel.get_hex_transactions = lambda txid_l: dict([(txid, prev_d[txid]) for txid in txid_l])
+
+exchange = ledger.exchange
+def exchange_own_session(apdu):
+    # what call() did: a session of its own for every APDU
+    try:
+        return exchange(apdu)
+    finally:
+        ledger.close()
+
+def sign():
+    # as a script would: from a closed device, with nothing uploaded yet
+    ledger.close()
+    Transaction.clear_trusted_inputs()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Transaction.sign_tx(tx, address_d)
+
+rows = []
+for name, ex in (('before', exchange_own_session), ('after', exchange)):
+    ledger.exchange = ex
+    count, opens[0] = device.apdu_count, 0
+    t = common.timed(sign, repeat = 3)
+    napdu = (device.apdu_count - count) // 3
+    rows.append((name, napdu, opens[0] // 3, '%.2f' % t, '%.0f' % (napdu / t)))
+ledger.close()
+
+common.report('ledger: signing %d inputs (open %.3fs, APDU %.3fs)' % (nin, open_cost, latency), ('', 'APDUs', 'opens', 'seconds', 'APDUs/s'), rows)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3.7
+
+# Serializing and hashing a 500-input transaction again and again, with
+# the cached serialization against the old rebuild on every call.
+#
+#   bench_tx.py [inputs] [calls]
+
+import os
+import struct
+
+import common
+
+from lwallet.serialize import ser_string, ser_compact_size
+from lwallet.Transaction import CTransaction, CTxIn, CTxOut, COutPoint, hash256
+
+nin = common.arg(1, 500)
+calls = common.arg(2, 100)
+
+# what serialize() and calc_sha256() were
+def old_serialize(tx):
+    b = struct.pack('<i', tx.nVersion)
+    b += ser_compact_size(len(tx.vin)) + b''.join([old_serialize_txin(v) for v in tx.vin])
+    b += ser_compact_size(len(tx.vout)) + b''.join([struct.pack('<q', v.nValue) + ser_string(v.scriptPubKey) for v in tx.vout])
+    b += struct.pack('<I', tx.nLockTime)
+    return b
+
+def old_serialize_txin(v):
+    b = v.prevout.hash + struct.pack('<I', v.prevout.n)
+    b += ser_string(v.scriptSig)
+    b += struct.pack('<I', v.nSequence)
+    return b
+
+def old_calc_sha256(tx):
+    return hash256(old_serialize(tx))
+
+tx = CTransaction()
+for i in range(nin):
+    tx.vin.append(CTxIn(COutPoint(os.urandom(32), i % 4), os.urandom(107), 0xffffffff))
+tx.vout = [CTxOut(1000, os.urandom(25)), CTxOut(2000, os.urandom(25))]
+assert old_serialize(tx) == tx.serialize()
+
+def repeat(f):
+    def run():
+        for _ in range(calls):
+            f()
+    return run
+
+def one_input_changed(serialize):
+    # as signature hashing does: one scriptSig set, the rest as they were
+    script = os.urandom(25)
+    def run():
+        for i in range(calls):
+            tx.vin[i % nin].scriptSig = script if i % 2 else b''
+            serialize(tx)
+    return run
+
+rows = []
+for name, before, after in (('serialize()', repeat(lambda: old_serialize(tx)), repeat(tx.serialize)),
+                            ('calc_sha256()', repeat(lambda: old_calc_sha256(tx)), repeat(tx.calc_sha256)),
+                            ('serialize() after one input changed', one_input_changed(old_serialize), one_input_changed(CTransaction.serialize))):
+    t0 = common.timed(before) / calls
+    t1 = common.timed(after) / calls
+    rows.append((name, '%.1f' % (t0 * 1e6), '%.1f' % (t1 * 1e6), '%.0fx' % (t0 / t1)))
+
+common.report('transaction: %d inputs, %d bytes' % (nin, len(tx.serialize())), ('', 'before us/call', 'after us/call', 'speedup'), rows)
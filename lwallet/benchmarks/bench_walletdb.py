@@ -0,0 +1,54 @@
+#!/usr/bin/env python3.7
+
+# Connections opened per walletdb operation, with one connection per
+# thread against the old fresh connection per call.
+#
+#   bench_walletdb.py [addresses]
+
+import sqlite3 as lite
+
+import common
+
+from lwallet import walletdb
+
+naddr = common.arg(1, 2000)
+
+txid = lambda i: '%064x' % i
+for i in range(naddr):
+    walletdb.put_address_db('address%d' % i, account = 0, index = i)
+walletdb.put_unspent_many([{'address': 'address%d' % i, 'txid': txid(2 * i + k), 'nout': k, 'script': '', 'satoshis': 1000} for i in range(naddr) for k in range(2)])
+for i in range(0, naddr, 10):
+    walletdb.lock_txid(txid(2 * i), 0)
+
+connects = [0]
+connect = lite.connect
+def counted(*args, **kw):
+    connects[0] += 1
+    return connect(*args, **kw)
+lite.connect = counted
+
+def before_con():
+    # what db_get_con() was: a new connection on every call
+    return lite.connect(walletdb._db_file())
+
+def operations():
+    # what get_address_d() and the send scripts' locked checks used to do:
+    # one helper call per address, then one per utxo
+    n = 0
+    for ae in walletdb.get_addresses_db():
+        for u in walletdb.get_unspent(ae['address']):
+            walletdb.is_locked_txid(u['txid'], u['nout'])
+            n += 1
+        n += 1
+    return n + 1
+
+rows = []
+for name, con in (('before', before_con), ('after', walletdb.db_get_con)):
+    walletdb.db_get_con = con
+    nops = operations()
+    connects[0] = 0
+    t = common.timed(operations, repeat = 3)
+    per_op = connects[0] / 3 / nops
+    rows.append((name, nops, '%.2f' % per_op, '%.0f' % (nops / t)))
+
+common.report('walletdb: %d addresses, %d utxos' % (naddr, 2 * naddr), ('', 'operations', 'connects/op', 'operations/s'), rows)
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import time
+
+# Benchmarks run in a scratch home, like the tests: eelocal reads
+# ~/.coinapi when imported, and walletdb and txcache write under
+# ~/.energidb.  Each benchmark times the code as it is against the way it
+# was done before, reproduced in the benchmark itself.
+
+_home = tempfile.mkdtemp()
+os.makedirs(os.path.join(_home, '.coinapi'))
+with open(os.path.join(_home, '.coinapi', 'apikey.config'), 'w') as f:
+    f.write('[ssh]\nhost = localhost\n')
+os.environ['HOME'] = _home
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+def timed(f, repeat = 5):
+    """
+        Best wall time of repeat calls of f(), in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+def report(title, header, rows):
+    print(title)
+    widths = [max(len(str(r[i])) for r in [header] + rows) for i in range(len(header))]
+    for r in [header] + rows:
+        print('  ' + '  '.join([str(v).ljust(w) if i == 0 else str(v).rjust(w) for i, (v, w) in enumerate(zip(r, widths))]))
+    print()
+
+def arg(i, default):
+    return type(default)(sys.argv[i]) if len(sys.argv) > i else default
@@ -0,0 +1,257 @@
+# Copyright 2019 Joshua Lackey
+
+import asyncio
+import base64
+import json
+import socket
+
+from coinapi import eelocal as eel
+
+# asyncio versions of the eelocal calls, returning the same things.  The
+# backend is whatever eelocal chose: with energid's JSON-RPC the requests
+# go over a pool of keep-alive connections, otherwise (energi-cli, ssh)
+# the blocking call runs in the default executor.  Either way at most
+# _max_connections requests are in flight at once, so callers can simply
+# gather() as many as they like.
+
+_max_connections = 8
+_timeout = 60
+
+_loop = None
+_sem = None
+_pool = []
+
+# ----*----*----*----*----*----*----*----*----*----*----*
+
+async def get_help():
+    return await do_cli(['help'])
+
+async def get_address_balance(a):
+    return json.loads(await do_cli(['getaddressbalance', '\'%s\'' % eel._address_format(a)]))
+
+async def get_address_txids(a):
+    return json.loads(await do_cli(['getaddresstxids', '\'%s\'' % eel._address_format(a)]))
+
+async def get_address_deltas(al, start = None, end = None):
+    return json.loads(await do_cli(['getaddressdeltas', '\'%s\'' % eel._addresses_format(al, start, end)]))
+
+async def get_used_addresses(al):
+    return set([d['address'] for d in await get_address_deltas(al)]) if len(al) > 0 else set()
+
+async def get_transaction(txid):
+    return json.loads(await do_cli(['getrawtransaction', txid, 'true']))
+
+async def get_hex_transaction(txid):
+    hexb = await do_cli(['getrawtransaction', txid, 'false'])
+    return hexb[:-1].decode('latin-1')
+
+async def get_hex_transactions(txid_l):
+    if eel.do_cli is eel._do_cli_rpc:
+        calls = [('getrawtransaction', [txid, False]) for txid in txid_l]
+        rll = await asyncio.gather(*[_rpc_batch(calls[i:i + eel._rpc_batch_size]) for i in range(0, len(calls), eel._rpc_batch_size)])
+        return dict(zip(txid_l, [r for rl in rll for r in rl]))
+    return dict(zip(txid_l, await asyncio.gather(*[get_hex_transaction(txid) for txid in txid_l])))
+
+async def get_masternodelist():
+    mnd = json.loads(await do_cli(['masternodelist']))
+    return [mnd[x] for x in mnd]
+
+async def get_masternodes():
+    mnd = json.loads(await do_cli(['masternodelist']))
+    r = {}
+    for k in mnd:
+        txid, nout = k.split('-')
+        mnd[k]['txid'] = txid
+        mnd[k]['nout'] = nout
+        r[mnd[k]['payee']] = mnd[k]
+    return r
+
+async def get_unspent(a):
+    return json.loads(await do_cli(['getaddressutxos', '\'%s\'' % eel._address_format(a)]))
+
+async def get_unspent_many(al):
+    rd = dict([(a, []) for a in al])
+    name_d = dict([(a.decode('latin-1') if isinstance(a, bytes) else a, a) for a in al])
+    n = eel._addresses_per_call
+    for ul in await asyncio.gather(*[do_cli(['getaddressutxos', '\'%s\'' % eel._addresses_format(al[i:i + n])]) for i in range(0, len(al), n)]):
+        for u in json.loads(ul):
+            rd[name_d[u['address']]].append(u)
+    return rd
+
+async def get_fee_estimate():
+    return json.loads(await do_cli(['estimatesmartfee', '6']))['feerate']
+
+async def decode_raw_transaction(tx):
+    return json.loads(await do_cli(['decoderawtransaction', tx]))
+
+async def decode_script(s):
+    return json.loads(await do_cli(['decodescript', s]))
+
+async def send_raw_transaction(tx):
+    return (await do_cli(['sendrawtransaction', tx]))[:-1]
+
+async def get_blockcount():
+    return json.loads(await do_cli(['getblockcount']))
+
+async def get_blockhash(height):
+    return (await do_cli(['getblockhash', str(height)]))[:-1]
+
+async def get_block(blockhash):
+    return json.loads(await do_cli(['getblock', blockhash, 'true']))
+
+async def mnb_decode(mnbl_hs):
+    return json.loads(await do_cli(['masternodebroadcast', 'decode', mnbl_hs]))
+
+async def mnb_relay(mnb_hs):
+    return json.loads(await do_cli(['masternodebroadcast', 'relay', mnb_hs]))
+
+async def import_address(a, alias, rescan = True):
+    await do_cli(['importaddress', a, alias, "true" if rescan else "false"])
+
+# ----*----*----*----*----*----*----*----*----*----*----*
+
+def _close_pool(loop, pool):
+    while len(pool) > 0:
+        reader, writer = pool.pop()
+        if loop.is_closed():
+            # nothing can run on that loop any more; just end the connection
+            try:
+                writer.get_extra_info('socket').shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        else:
+            writer.close()
+
+async def _pool_keeper(loop, pool):
+    # asyncio.run() cancels this while shutting the loop down, which is the
+    # last chance to close the pool's connections properly
+    try:
+        await loop.create_future()
+    finally:
+        _close_pool(loop, pool)
+
+def _semaphore():
+    # the semaphore and pooled connections belong to one event loop
+    global _loop
+    global _sem
+    global _pool
+
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:
+        if _loop is not None:
+            _close_pool(_loop, _pool)
+        _loop = loop
+        _sem = asyncio.Semaphore(_max_connections)
+        _pool = []
+        loop.create_task(_pool_keeper(loop, _pool))
+    return _sem
+
+async def _read_response(reader, line):
+    status = int(line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        k, v = line.decode('latin-1').split(':', 1)
+        headers[k.strip().lower()] = v.strip()
+
+    keep = headers.get('connection', '').lower() != 'close'
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        data = b''
+        while True:
+            n = int((await reader.readline()).split(b';')[0], 16)
+            if n == 0:
+                await reader.readline()
+                break
+            data += await reader.readexactly(n)
+            await reader.readexactly(2)
+    elif 'content-length' in headers:
+        data = await reader.readexactly(int(headers['content-length']))
+    else:
+        data = await reader.read()
+        keep = False
+
+    return status, data, keep
+
+async def _rpc_post(body):
+    body = body.encode()
+    request = ('POST / HTTP/1.1\r\n'
+               'Host: %s:%d\r\n'
+               'Authorization: Basic %s\r\n'
+               'Content-Type: application/json\r\n'
+               'Content-Length: %d\r\n'
+               '\r\n' % (eel._rpc_host, eel._rpc_port, base64.b64encode(eel._rpc_auth.encode()).decode(), len(body))).encode() + body
+
+    async with _semaphore():
+        # as in eelocal, only a pooled connection that energid closed while
+        # idle (it fails before any answer) is worth resending on, once
+        for attempt in range(2):
+            con = _pool.pop() if len(_pool) > 0 else None
+            pooled = con is not None
+            answered = False
+            keep = False
+            try:
+                deadline = asyncio.get_running_loop().time() + _timeout
+                if con is None:
+                    con = await asyncio.wait_for(asyncio.open_connection(eel._rpc_host, eel._rpc_port), _timeout)
+                con[1].write(request)
+                await con[1].drain()
+                line = await asyncio.wait_for(con[0].readline(), deadline - asyncio.get_running_loop().time())
+                if len(line) == 0:
+                    raise ConnectionError('energid closed the connection')
+                answered = True
+                status, data, keep = await asyncio.wait_for(_read_response(con[0], line), deadline - asyncio.get_running_loop().time())
+                break
+            except (OSError, EOFError, ValueError, IndexError, asyncio.TimeoutError) as e:
+                if attempt > 0 or not pooled or answered or not isinstance(e, ConnectionError):
+                    raise
+            finally:
+                # only a connection that finished an exchange goes back to
+                # the pool (not one that failed, timed out or was cancelled)
+                if con is not None:
+                    if keep:
+                        _pool.append(con)
+                    else:
+                        con[1].close()
+
+    if status == 401:
+        raise RuntimeError('energid rpc: authorization failed')
+    return data
+
+async def _rpc(method, params = []):
+    r = json.loads(await _rpc_post(json.dumps({'jsonrpc': '1.0', 'id': next(eel._rpc_id), 'method': method, 'params': params})))
+    if r.get('error') is not None:
+        raise RuntimeError('%s: %s' % (method, r['error'].get('message', r['error'])))
+    return r['result']
+
+async def _rpc_batch(calls):
+    reql = [{'jsonrpc': '1.0', 'id': next(eel._rpc_id), 'method': m, 'params': p} for m, p in calls]
+    rd = dict([(r['id'], r) for r in json.loads(await _rpc_post(json.dumps(reql)))])
+    rl = []
+    for req in reql:
+        r = rd.get(req['id'])
+        if r is None:
+            raise RuntimeError('%s: no response in batch' % req['method'])
+        if r.get('error') is not None:
+            raise RuntimeError('%s: %s' % (req['method'], r['error'].get('message', r['error'])))
+        rl.append(r['result'])
+    return rl
+
+async def do_cli(c):
+    """
+        Like eelocal.do_cli(): returns what energi-cli would print.
+    """
+    if eel.do_cli is not eel._do_cli_rpc:
+        async with _semaphore():
+            return await asyncio.get_running_loop().run_in_executor(None, eel.do_cli, c)
+
+    method = c[0]
+    return eel._rpc_output(await _rpc(method, [eel._rpc_param(method, i, a) for i, a in enumerate(c[1:])]))
+
+async def close():
+    """
+        Closes the pooled connections.
+    """
+    _close_pool(asyncio.get_running_loop(), _pool)
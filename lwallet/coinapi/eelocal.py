@@ -1,7 +1,14 @@
 # Copyright 2019 Joshua Lackey
 
+import atexit
+import base64
+import hashlib
+import http.client
+import itertools
 import json
+import os
 import subprocess
+import threading
 
 from coinapi import apiconfig
 
@@ -10,10 +17,18 @@ from coinapi import apiconfig
 def get_help():
     return do_cli(['help'])
 
+# addresses per getaddressutxos call (keeps energi-cli command lines short)
+_addresses_per_call = 500
+
 def _address_format(a):
-    if isinstance(a, bytes):
-        a = ''.join(['%c' % c for c in a])
-    return json.dumps({'addresses': [a]})
+    return _addresses_format([a])
+
+def _addresses_format(al, start = None, end = None):
+    q = {'addresses': [a.decode('latin-1') if isinstance(a, bytes) else a for a in al]}
+    if start is not None:
+        q['start'] = start
+        q['end'] = end
+    return json.dumps(q)
 
 def get_address_balance(a):
     return json.loads(do_cli(['getaddressbalance', '\'%s\'' % _address_format(a)]))
@@ -21,12 +36,36 @@ def get_address_balance(a):
 def get_address_txids(a):
     return json.loads(do_cli(['getaddresstxids', '\'%s\'' % _address_format(a)]))
 
+def get_address_deltas(al, start = None, end = None):
+    """
+        Every credit and debit of the addresses in al; only those in blocks
+        start to end (inclusive) if start is given.
+    """
+    return json.loads(do_cli(['getaddressdeltas', '\'%s\'' % _addresses_format(al, start, end)]))
+
+def get_used_addresses(al):
+    """
+        The addresses in al that appear in any transaction, with one call.
+        (getaddresstxids merges the txids of all addresses, so it cannot
+        tell which of them were used; getaddressdeltas can.)
+    """
+    return set([d['address'] for d in get_address_deltas(al)]) if len(al) > 0 else set()
+
 def get_transaction(txid):
     return json.loads(do_cli(['getrawtransaction', txid, 'true']))
 
 def get_hex_transaction(txid):
     hexb = do_cli(['getrawtransaction', txid, 'false'])
-    return ''.join('%c' % c for c in hexb[:-1])
+    return hexb[:-1].decode('latin-1')
+
+def get_hex_transactions(txid_l):
+    """
+        Returns a dictionary txid -> hex transaction; one JSON-RPC batch
+        when talking to energid directly.
+    """
+    if do_cli is _do_cli_rpc:
+        return dict(zip(txid_l, _rpc_batch([('getrawtransaction', [txid, False]) for txid in txid_l])))
+    return dict([(txid, get_hex_transaction(txid)) for txid in txid_l])
 
 def get_masternodelist():
     mnd = json.loads(do_cli(['masternodelist']))
@@ -45,6 +84,18 @@ def get_masternodes():
 def get_unspent(a):
     return json.loads(do_cli(['getaddressutxos', '\'%s\'' % _address_format(a)]))
 
+def get_unspent_many(al):
+    """
+        The unspent outputs of many addresses, in as few calls as possible.
+        Returns a dictionary address -> list (as get_unspent gives).
+    """
+    rd = dict([(a, []) for a in al])
+    name_d = dict([(a.decode('latin-1') if isinstance(a, bytes) else a, a) for a in al])
+    for i in range(0, len(al), _addresses_per_call):
+        for u in json.loads(do_cli(['getaddressutxos', '\'%s\'' % _addresses_format(al[i:i + _addresses_per_call])])):
+            rd[name_d[u['address']]].append(u)
+    return rd
+
 def get_fee_estimate():
     return json.loads(do_cli(['estimatesmartfee', '6']))['feerate']
 
@@ -84,13 +135,87 @@ def import_address(a, alias, rescan = True):
 
 # ----*----*----*----*----*----*----*----*----*----*----*
 
-def _do_ssh(c):
-    rc = ['ssh']
+# One multiplexed ssh connection (an OpenSSH ControlMaster) is started
+# the first time it is needed and every energi-cli call then runs over
+# it, skipping the key exchange.  It is shut down when we exit;
+# ControlPersist only cleans up after a process that did not get to.
+# "multiplex = no" in the [ssh] section turns this off.
+
+_ssh_multiplex = True
+_ssh_control = None
+_ssh_persist = 600
+_ssh_lock = threading.Lock()
+_ssh_master = False
+_ssh_master_failed = False
+_ssh_stats = {'calls': 0, 'reused': 0, 'connects': 0, 'masters': 0}
+
+def _ssh_target():
+    rc = []
     if _keyfile is not None:
         rc += ['-i', _keyfile]
     rh = ('%s@%s' % (_user, _host)) if _user is not None else _host
-    rc += [rh, c, '2>&1']
-    return subprocess.check_output(rc)
+    return rc, rh
+
+def _ssh_start_master():
+    global _ssh_master
+    global _ssh_master_failed
+
+    rc, rh = _ssh_target()
+    try:
+        subprocess.check_call(['ssh'] + rc + ['-M', '-N', '-f',
+                                '-o', 'ControlPath=%s' % _ssh_control,
+                                '-o', 'ControlPersist=%d' % _ssh_persist, rh],
+                              stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        _ssh_master_failed = True
+        return
+    if not _ssh_master:
+        atexit.register(_ssh_stop_master)
+    _ssh_master = True
+    _ssh_stats['masters'] += 1
+
+def _ssh_stop_master():
+    global _ssh_master
+
+    if not _ssh_master:
+        return
+    rc, rh = _ssh_target()
+    subprocess.call(['ssh'] + rc + ['-o', 'ControlPath=%s' % _ssh_control, '-O', 'exit', rh],
+                    stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    _ssh_master = False
+
+def _ssh_connection():
+    """
+        ssh options to reach the remote node: over the control socket when
+        there is one (starting it if need be), otherwise a connection of
+        its own.
+    """
+    rc, rh = _ssh_target()
+    if not _ssh_multiplex:
+        return rc, rh, False
+
+    with _ssh_lock:
+        if not os.path.exists(_ssh_control) and not _ssh_master_failed:
+            _ssh_start_master()
+        reused = os.path.exists(_ssh_control)
+
+    # ControlMaster=no: if the socket went away, ssh just connects itself
+    return rc + ['-o', 'ControlMaster=no', '-o', 'ControlPath=%s' % _ssh_control], rh, reused
+
+def _do_ssh(c):
+    rc, rh, reused = _ssh_connection()
+    with _ssh_lock:
+        _ssh_stats['calls'] += 1
+        _ssh_stats['reused' if reused else 'connects'] += 1
+    return subprocess.check_output(['ssh'] + rc + [rh, c, '2>&1'])
+
+def get_ssh_stats():
+    """
+        How many remote calls were made and how many of them went over the
+        shared connection rather than a new one.
+    """
+    with _ssh_lock:
+        return dict(_ssh_stats)
 
 def _do_cli_remote(c):
     c = ' '.join(c)
@@ -102,16 +227,190 @@ def _do_cli_local(c):
 
 # ----*----*----*----*----*----*----*----*----*----*----*
 
+# JSON-RPC straight to energid, over one keep-alive connection per thread.
+# Settings come from an [rpc] section (host, port, user, password) in the
+# coinapi config file or else from energid's own energi.conf (or .cookie).
+# _do_cli_rpc() returns what energi-cli would have printed, so everything
+# above works unchanged with any backend.
+
+_energi_dir = '~/.energicore'
+_energi_conf = 'energi.conf'
+_rpc_port_default = 9796
+
+_rpc_host = None
+_rpc_port = None
+_rpc_auth = None
+_rpc_local = threading.local()
+_rpc_id = itertools.count(1)
+_rpc_batch_size = 100
+_rpc_timeout = 60
+
+# arguments energi-cli passes as JSON rather than as strings
+_rpc_convert = {
+    'getaddressbalance':    [0],
+    'getaddressdeltas':     [0],
+    'getaddresstxids':      [0],
+    'getaddressutxos':      [0],
+    'getrawtransaction':    [1],
+    'estimatesmartfee':     [0],
+    'getblockhash':         [0],
+    'getblock':             [1],
+    'sendrawtransaction':   [1],
+    'importaddress':        [2]
+}
+
+def _read_energi_conf():
+    d = {}
+    try:
+        with open(os.path.join(os.path.expanduser(_energi_dir), _energi_conf)) as f:
+            for l in f:
+                l = l.split('#')[0].strip()
+                if '=' in l:
+                    k, v = l.split('=', 1)
+                    d.setdefault(k.strip(), v.strip())
+    except FileNotFoundError:
+        pass
+    return d
+
+def _read_cookie():
+    try:
+        with open(os.path.join(os.path.expanduser(_energi_dir), '.cookie')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _rpc_settings(config):
+    """
+        (host, port, user:password) for energid, or None if there is no way
+        to authenticate.
+    """
+    if config is not None and 'rpc' in config.sections():
+        rpc = config['rpc']
+        host = rpc.get('host', '127.0.0.1')
+        port = int(rpc.get('port', _rpc_port_default))
+        if 'user' in rpc and 'password' in rpc:
+            return host, port, '%s:%s' % (rpc['user'], rpc['password'])
+        cookie = _read_cookie()
+        return (host, port, cookie) if cookie is not None else None
+
+    conf = _read_energi_conf()
+    host = conf.get('rpcconnect', '127.0.0.1')
+    port = int(conf.get('rpcport', _rpc_port_default))
+    if 'rpcuser' in conf and 'rpcpassword' in conf:
+        return host, port, '%s:%s' % (conf['rpcuser'], conf['rpcpassword'])
+    cookie = _read_cookie()
+    return (host, port, cookie) if cookie is not None else None
+
+def _rpc_connection():
+    con = getattr(_rpc_local, 'con', None)
+    if con is None:
+        con = http.client.HTTPConnection(_rpc_host, _rpc_port, timeout = _rpc_timeout)
+        _rpc_local.con = con
+    return con
+
+def _rpc_close():
+    con = getattr(_rpc_local, 'con', None)
+    if con is not None:
+        con.close()
+        _rpc_local.con = None
+
+def _rpc_post(body):
+    headers = {
+        'Authorization': 'Basic ' + base64.b64encode(_rpc_auth.encode()).decode(),
+        'Content-Type': 'application/json'
+    }
+
+    # A kept-alive connection may have been closed by energid while idle,
+    # which shows as the connection failing before any answer; only then
+    # is the request resent (once).  Anything else, a timeout included,
+    # may have reached energid, and sendrawtransaction must not run twice.
+    for attempt in range(2):
+        con = _rpc_connection()
+        reused = con.sock is not None
+        r = None
+        try:
+            con.request('POST', '/', body, headers)
+            r = con.getresponse()
+            data = r.read()
+            break
+        except (http.client.HTTPException, OSError) as e:
+            _rpc_close()
+            if attempt > 0 or not reused or r is not None or not isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)):
+                raise
+
+    if r.status == 401:
+        raise RuntimeError('energid rpc: authorization failed')
+    return data
+
+def _rpc(method, params = []):
+    r = json.loads(_rpc_post(json.dumps({'jsonrpc': '1.0', 'id': next(_rpc_id), 'method': method, 'params': params})))
+    if r.get('error') is not None:
+        raise RuntimeError('%s: %s' % (method, r['error'].get('message', r['error'])))
+    return r['result']
+
+def _rpc_batch(calls):
+    """
+        Results of several (method, params) calls, in order.  They are sent
+        as JSON-RPC batches of up to _rpc_batch_size calls.
+    """
+    rl = []
+    for i in range(0, len(calls), _rpc_batch_size):
+        reql = [{'jsonrpc': '1.0', 'id': next(_rpc_id), 'method': m, 'params': p} for m, p in calls[i:i + _rpc_batch_size]]
+        rd = dict([(r['id'], r) for r in json.loads(_rpc_post(json.dumps(reql)))])
+        for req in reql:
+            r = rd.get(req['id'])
+            if r is None:
+                raise RuntimeError('%s: no response in batch' % req['method'])
+            if r.get('error') is not None:
+                raise RuntimeError('%s: %s' % (req['method'], r['error'].get('message', r['error'])))
+            rl.append(r['result'])
+    return rl
+
+def _rpc_param(method, i, a):
+    # arguments were quoted for the shell
+    if len(a) >= 2 and a[0] == a[-1] == '\'':
+        a = a[1:-1]
+    return json.loads(a) if i in _rpc_convert.get(method, []) else a
+
+def _rpc_output(r):
+    # what energi-cli prints for result r
+    if r is None:
+        return b''
+    if isinstance(r, str):
+        return (r + '\n').encode()
+    return (json.dumps(r, indent = 2) + '\n').encode()
+
+def _do_cli_rpc(c):
+    method = c[0]
+    return _rpc_output(_rpc(method, [_rpc_param(method, i, a) for i, a in enumerate(c[1:])]))
+
+# ----*----*----*----*----*----*----*----*----*----*----*
+
 def do_config():
 
     global do_cli
     global _keyfile
     global _user
     global _host
-
-    import os
+    global _rpc_host
+    global _rpc_port
+    global _rpc_auth
+    global _ssh_multiplex
+    global _ssh_control
 
     configd = apiconfig.get_configd()
+
+    # prefer talking to energid directly
+    rpc = _rpc_settings(configd['config'])
+    if rpc is not None:
+        _rpc_host, _rpc_port, _rpc_auth = rpc
+        try:
+            _rpc('ping')
+            do_cli = _do_cli_rpc
+            return
+        except Exception:
+            _rpc_close()
+
     try:
         _ = subprocess.check_output('/usr/local/bin/energi-cli ping 2>&1', shell = True)
         do_cli = _do_cli_local
@@ -133,6 +432,11 @@ def do_config():
         raise RuntimeError('must have host entry in [ssh] section of config file')
 
     _host = config['ssh']['host']
+
+    # the socket name only has to be unique per remote account (and short)
+    _ssh_multiplex = config['ssh'].getboolean('multiplex', fallback = True)
+    _ssh_control = os.path.join(configd['config_dir'], 'ssh-%s' % hashlib.sha1(('%s@%s %s' % (_user, _host, _keyfile)).encode()).hexdigest()[:16])
+
     do_cli = _do_cli_remote
 
 do_config()
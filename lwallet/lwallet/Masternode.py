@@ -18,9 +18,6 @@ def get_block_hash(n = 12):
 
 #----#----#----#----#----#----#----#----#----#----#----#----#----#----#----#
 
-def b2hs(b):
-    return ''.join(['%2.2x' % c for c in b])
-
 def sha256(s):
     return hashlib.new('sha256', s).digest()
 
@@ -1,13 +1,14 @@
-import copy
+import concurrent.futures
 import hashlib
-from io import BytesIO, StringIO
+import itertools
+import os
 import random
 import secp256k1
 import struct
 import sys
 
 from coinapi import eelocal as eel
-from lwallet import address, energi, ledger, script, serialize
+from lwallet import address, energi, ledger, script, serialize, txcache
 from lwallet.serialize import ser_string, deser_string, ser_vector, deser_vector, b2hs, hs2b
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
@@ -20,64 +21,138 @@ def hash256(s):
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
-class COutPoint:
+# Serialized bytes (and the txid) are cached on each object.  Assigning any
+# of a class's _fields stamps the object with a new generation number; a
+# cached value is reused only while the generations it was built from are
+# unchanged.  A transaction's key includes the keys of its inputs and
+# outputs, so changing a vin/vout in place, or the vin/vout lists
+# themselves, is noticed too.
+
+_generation = itertools.count(1)
+
+class _Cached:
+    _fields = ()
+    _gen = 0
+    _ser = None
+    _ser_key = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._fields:
+            object.__setattr__(self, '_gen', next(_generation))
+
+    def cache_key(self):
+        return self._gen
+
+    def serialize(self):
+        key = self.cache_key()
+        if key != self._ser_key:
+            object.__setattr__(self, '_ser', self._serialize())
+            object.__setattr__(self, '_ser_key', key)
+        return self._ser
+
+    def copy(self):
+        # a copy has the same contents, so it can share the cache (and the
+        # generation) until either one is changed
+        c = object.__new__(self.__class__)
+        c.__dict__.update(self.__dict__)
+        return c
+
+class COutPoint(_Cached):
+    _fields = ('hash', 'n')
+
     def __init__(self, hashin = b'', n = 0):
         self.hash = hashin[::-1] # txid
         if len(self.hash) < 32:
             self.hash += b'\x00' * (32 - len(self.hash))
         self.n = n
 
-    def serialize(self):
+    def _serialize(self):
         return self.hash + struct.pack('<I', self.n)
 
     def deserialize(self, m):
-        self.hash = m.read(32)
-        self.n = struct.unpack('<I', m.read(4))[0]
+        self.hash = bytes(m.read(32))
+        self.n = serialize.deser_uint32(m)
         return self
 
     def __repr__(self):
         return 'COutPoint(hash = %s, n = %i)' % (b2hs(self.hash[::-1]), self.n)
 
-class CTxIn:
+class CTxIn(_Cached):
+    _fields = ('prevout', 'scriptSig', 'nSequence')
+
     def __init__(self, outpoint = None, scriptSig = b'', nSequence = 0):
         self.prevout = COutPoint() if outpoint is None else outpoint
         self.scriptSig = scriptSig
         self.nSequence = nSequence
 
-    def serialize(self):
-        b = self.prevout.serialize()
-        b += ser_string(self.scriptSig)
-        b += struct.pack('<I', self.nSequence)
-        return b
+    # When deserialized from a serialize.ByteReader the script is a
+    # memoryview into the source buffer; it is only copied out when read.
+    @property
+    def scriptSig(self):
+        if isinstance(self._scriptSig, memoryview):
+            self._scriptSig = self._scriptSig.tobytes()
+        return self._scriptSig
+
+    @scriptSig.setter
+    def scriptSig(self, scriptSig):
+        self._scriptSig = scriptSig
+
+    def cache_key(self):
+        return (self._gen, self.prevout._gen)
+
+    def _serialize(self):
+        return b''.join([self.prevout.serialize(), ser_string(self._scriptSig), struct.pack('<I', self.nSequence)])
 
     def deserialize(self, m):
         self.prevout = COutPoint()
         self.prevout.deserialize(m)
         self.scriptSig = deser_string(m)
-        self.nSequence = struct.unpack('<I', m.read(4))[0]
+        self.nSequence = serialize.deser_uint32(m)
         return self
 
+    def copy(self):
+        c = _Cached.copy(self)
+        object.__setattr__(c, 'prevout', self.prevout.copy())
+        return c
+
     def __repr__(self):
-        return 'CTxIn(prevout = %s, scriptSig = %s, nSequence = %i)' % (repr(self.prevout), b2hs(self.scriptSig), self.nSequence)
+        return 'CTxIn(prevout = %s, scriptSig = %s, nSequence = %i)' % (repr(self.prevout), b2hs(self._scriptSig), self.nSequence)
+
+class CTxOut(_Cached):
+    _fields = ('nValue', 'scriptPubKey')
 
-class CTxOut:
     def __init__(self, nValue = 0, scriptPubKey = b''):
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
 
-    def serialize(self):
-        return struct.pack('<q', self.nValue) + ser_string(self.scriptPubKey)
+    # see CTxIn.scriptSig
+    @property
+    def scriptPubKey(self):
+        if isinstance(self._scriptPubKey, memoryview):
+            self._scriptPubKey = self._scriptPubKey.tobytes()
+        return self._scriptPubKey
+
+    @scriptPubKey.setter
+    def scriptPubKey(self, scriptPubKey):
+        self._scriptPubKey = scriptPubKey
+
+    def _serialize(self):
+        return struct.pack('<q', self.nValue) + ser_string(self._scriptPubKey)
 
     def deserialize(self, m):
-        self.nValue = struct.unpack('<q', m.read(8))[0]
+        self.nValue = serialize.deser_int64(m)
         self.scriptPubKey = deser_string(m)
         return self
 
     def __repr__(self):
         _NRGSAT = 10**8
-        return 'CTxOut(nValue = %i.%08i, scriptPubKey = %s)' % (self.nValue // _NRGSAT, self.nValue % _NRGSAT, b2hs(self.scriptPubKey))
+        return 'CTxOut(nValue = %i.%08i, scriptPubKey = %s)' % (self.nValue // _NRGSAT, self.nValue % _NRGSAT, b2hs(self._scriptPubKey))
+
+class CTransaction(_Cached):
+    _fields = ('nVersion', 'vin', 'vout', 'nLockTime')
+    _hash_key = None
 
-class CTransaction:
     def __init__(self, tx = None):
         if tx is None:
             self.nVersion = 1
@@ -88,24 +163,28 @@ class CTransaction:
             self.hash = None
         else:
             self.nVersion = tx.nVersion
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            self.vin = [v.copy() for v in tx.vin]
+            self.vout = [v.copy() for v in tx.vout]
             self.nLockTime = tx.nLockTime
             self.sha256 = tx.sha256
             self.hash = tx.hash
 
-    def serialize(self):
-        b = struct.pack('<i', self.nVersion)
-        b += ser_vector(self.vin)
-        b += ser_vector(self.vout)
-        b += struct.pack('<I', self.nLockTime)
-        return b
+    def cache_key(self):
+        return (self._gen, tuple([v.cache_key() for v in self.vin]), tuple([v.cache_key() for v in self.vout]))
+
+    def _serialize(self):
+        # one join over the (cached) inputs and outputs
+        return b''.join([struct.pack('<i', self.nVersion), serialize.ser_compact_size(len(self.vin))] +
+                        [v.serialize() for v in self.vin] +
+                        [serialize.ser_compact_size(len(self.vout))] +
+                        [v.serialize() for v in self.vout] +
+                        [struct.pack('<I', self.nLockTime)])
 
     def deserialize(self, m):
-        self.nVersion = struct.unpack('<i', m.read(4))[0]
+        self.nVersion = serialize.deser_int32(m)
         self.vin = deser_vector(m, CTxIn)
         self.vout = deser_vector(m, CTxOut)
-        self.nLockTime = struct.unpack('<I', m.read(4))[0]
+        self.nLockTime = serialize.deser_uint32(m)
         self.hash256 = None
         self.hash = None
         return self
@@ -114,8 +193,12 @@ class CTransaction:
         self.calc_sha256()
 
     def calc_sha256(self):
-        self.hash256 = hash256(self.serialize())
-        self.hash = b2hs(self.hash256) # for display purposes
+        key = self.cache_key()
+        if key != self._hash_key:
+            self.hash256 = hash256(self.serialize())
+            self.hash = b2hs(self.hash256) # for display purposes
+            self._hash_key = key
+        return self.hash256
 
     def __repr__(self):
         return 'CTransaction(nVersion = %i, vin = %s, vout = %s, nLockTime = %i)' % (self.nVersion, repr(self.vin), repr(self.vout), self.nLockTime)
@@ -133,53 +216,102 @@ _hashtype_d = {
 }
 _hashtype_rev_d = { _hashtype_d[k]: k for k in _hashtype_d.keys() }
 
-def signature_hash(script_code, txto, inIdx, hashtype):
-    if inIdx >= len(txto.vin):
-        raise RuntimeError('input index out of range (%d >= %d)' % (i, len(txto.vin)))
-
-    txtmp = CTransaction(txto)
-
-    for i in range(len(txtmp.vin)):
-        if i != inIdx:
-            txtmp.vin[i].scriptSig = b''
-    txtmp.vin[inIdx].scriptSig = script.remove(script_code, [script.get_opcode('OP_CODESEPARATOR')])
+class SignatureHasher:
+    """
+        Legacy signature hashes for the inputs of one transaction.  The
+        pieces every preimage shares (version, outputs, locktime and each
+        input serialized with an empty script) are built once, and the
+        preimage for an input is spliced together from them, so hashing
+        all n inputs no longer copies and re-serializes the transaction n
+        times.
+    """
+
+    _blank_len = 36 + 1 + 4 # prevout, empty script, nSequence
+
+    def __init__(self, txto):
+        self.nin = len(txto.vin)
+        self.version = struct.pack('<i', txto.nVersion)
+        self.locktime = struct.pack('<I', txto.nLockTime)
+        self.prevouts = [v.prevout.serialize() for v in txto.vin]
+        self.sequences = [struct.pack('<I', v.nSequence) for v in txto.vin]
+        self.vout = [v.serialize() for v in txto.vout]
+        self.outputs = serialize.ser_compact_size(len(self.vout)) + b''.join(self.vout)
+        self.blank = b''.join([p + b'\x00' + q for p, q in zip(self.prevouts, self.sequences)])
+        self._blank_noseq = None
+
+    def blank_noseq(self):
+        # inputs with empty scripts and nSequence = 0 (SIGHASH_NONE, SIGHASH_SINGLE)
+        if self._blank_noseq is None:
+            self._blank_noseq = b''.join([p + b'\x00' + b'\x00' * 4 for p in self.prevouts])
+        return self._blank_noseq
+
+    def hash(self, script_code, inIdx, hashtype):
+        if inIdx >= self.nin:
+            raise RuntimeError('input index out of range (%d >= %d)' % (inIdx, self.nin))
+
+        script_code = script.remove(script_code, [script.get_opcode('OP_CODESEPARATOR')])
+        txin = self.prevouts[inIdx] + ser_string(script_code) + self.sequences[inIdx]
+
+        if (hashtype & 0x1f) == _hashtype_d['SIGHASH_NONE']:
+            outputs = serialize.ser_compact_size(0)
+            blank = self.blank_noseq()
+
+        elif (hashtype & 0x1f) == _hashtype_d['SIGHASH_SINGLE']:
+            outIdx = inIdx
+            if outIdx >= len(self.vout):
+                raise RuntimeError('output index out of range (%d >= %d)' % (outIdx, len(self.vout)))
+
+            outputs = serialize.ser_compact_size(outIdx + 1) + CTxOut(-1).serialize() * outIdx + self.vout[outIdx]
+            blank = self.blank_noseq()
 
-    if (hashtype & 0x1f) == _hashtype_d['SIGHASH_NONE']:
-        txtmp.vout = []
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
-
-    elif (hashtype & 0x1f) == _hashtype_d['SIGHASH_SINGLE']:
-        outIdx = inIdx
-        if outIdx >= len(txtmp.vout):
-            raise RuntimeError('output index out of range (%d >= %d)' % (outIdx, len(txtmp.vout)))
-
-        tmp = txtmp.vout[outIdx]
-        txtmp.vout = []
-        for i in range(outIdx):
-            txtmp.vout.append(CTxOut(-1))
-        txtmp.vout.append(tmp)
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
-
-    if hashtype & _hashtype_d['SIGHASH_ANYONECANPAY']:
-        txtmp.vin = [txtmp.vin[inIdx]]
+        else:
+            outputs = self.outputs
+            blank = self.blank
 
-    s = txtmp.serialize()
-    s += struct.pack(b'<I', hashtype)
+        if hashtype & _hashtype_d['SIGHASH_ANYONECANPAY']:
+            inputs = serialize.ser_compact_size(1) + txin
+        else:
+            o = inIdx * self._blank_len
+            inputs = serialize.ser_compact_size(self.nin) + blank[:o] + txin + blank[o + self._blank_len:]
 
-    return hash256(s)
+        return hash256(b''.join([self.version, inputs, outputs, self.locktime, struct.pack('<I', hashtype)]))
 
-def verify_tx(tx_in, prevout_d = {}):
+def signature_hash(script_code, txto, inIdx, hashtype):
+    return SignatureHasher(txto).hash(script_code, inIdx, hashtype)
+
+def _resolve_prevouts(tx, prevout_d = {}):
+    # each distinct previous transaction is fetched (in one request) and parsed once
+    txid_l = []
+    for v in tx.vin:
+        txid = serialize.b2hs(v.prevout.hash[::-1])
+        if txid not in txid_l:
+            txid_l.append(txid)
+    hex_d = txcache.get_hex_transactions([txid for txid in txid_l if txid not in prevout_d])
+
+    tx_d = {}
+    for txid in txid_l:
+        tx_i_hex = prevout_d[txid]['hex'] if txid in prevout_d else hex_d[txid]
+        tx_d[txid] = CTransaction().deserialize(serialize.ByteReader(serialize.hs2b(tx_i_hex)))
+    return tx_d
+
+def _ecdsa_verify(public_key, signature, sighash):
+    pubkey = secp256k1.PublicKey(public_key, raw = True)
+    sig = pubkey.ecdsa_deserialize(signature)
+    return pubkey.ecdsa_verify(sighash, sig, raw = True)
+
+def verify_tx_inputs(tx_in, prevout_d = {}, workers = None):
+    """
+        Returns a list with the result of the signature check of each input.
+        The previous transactions are all resolved before any signature is
+        checked, and the ECDSA verifications are spread over a pool of
+        `workers' threads (libsecp256k1 runs without the GIL).
+    """
     tx = CTransaction(tx_in)
 
-    if len(tx.vin) == 0:
-        return False
+    tx_d = _resolve_prevouts(tx, prevout_d)
+    hasher = SignatureHasher(tx)
 
-    # check each input signature
+    jobs = []
     for i in range(len(tx.vin)):
 
         # get the signature, hash type, and public key (from the standard P2PKH)
@@ -195,15 +327,9 @@ def verify_tx(tx_in, prevout_d = {}):
         if hashtype not in _hashtype_rev_d.keys():
             raise RuntimeError('hashtype in signature not recognized')
 
-        # get the txid for the output this input refers to
-        txid = serialize.b2hs(tx.vin[i].prevout.hash[::-1])
-
-        # get the transaction from prevout dictionary or energid if not provided
-        tx_i_hex = prevout_d[txid]['hex'] if txid in prevout_d else eel.get_hex_transaction(txid)
-        tx_i = CTransaction().deserialize(BytesIO(serialize.hs2b(tx_i_hex)))
-
-        n = tx.vin[i].prevout.n
-        vout = tx_i.vout[n]
+        # the output this input refers to
+        tx_i = tx_d[serialize.b2hs(tx.vin[i].prevout.hash[::-1])]
+        vout = tx_i.vout[tx.vin[i].prevout.n]
 
         vout_spkd = script.disass(vout.scriptPubKey)
         vout_hpk = vout_spkd[2]['data']
@@ -212,12 +338,24 @@ def verify_tx(tx_in, prevout_d = {}):
         if hpk != vout_hpk:
             raise RuntimeError('OP_EQUALVERIFY failed: %s != %s' % (serialize.b2hs(hpk), serialize.b2hs(vout_hpk)))
 
-        sighash = signature_hash(vout.scriptPubKey, tx_in, i, hashtype)
-        pubkey = secp256k1.PublicKey(public_key, raw = True)
-        sig = pubkey.ecdsa_deserialize(signature)
+        jobs.append((public_key, signature, hasher.hash(vout.scriptPubKey, i, hashtype)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+
+    if workers <= 1:
+        return [_ecdsa_verify(*j) for j in jobs]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as ex:
+        return list(ex.map(lambda j: _ecdsa_verify(*j), jobs))
+
+def verify_tx(tx_in, prevout_d = {}, workers = None):
+    if len(tx_in.vin) == 0:
+        return False
 
-        if not pubkey.ecdsa_verify(sighash, sig, raw = True):
-            return False
+    if not all(verify_tx_inputs(tx_in, prevout_d, workers)):
+        return False
 
     # check output address for each
     #for i in range(len(tx.vout)):
@@ -231,14 +369,117 @@ def verify_tx(tx_in, prevout_d = {}):
 
     return True
 
+# The device parses the previous transaction as one byte stream spread
+# over GET TRUSTED INPUT APDUs, so APDUs are filled regardless of field
+# boundaries, except where its parser needs a run of bytes within a single
+# APDU: version and input count, each prevout with its script length, the
+# last script byte of an input with its sequence, the output count, each
+# amount with its script length, and the locktime, which must also end the
+# final APDU.  Everything else (the scripts) may be split anywhere.
+
+_TRUSTED_INPUT_FIRST = 255 - 4 # the first APDU also carries the output index
+_TRUSTED_INPUT_NEXT  = 255
+
+def _trusted_input_segments(tx):
+    # (bytes, splittable)
+    yield struct.pack('<i', tx.nVersion) + serialize.ser_compact_size(len(tx.vin)), False
+    for v in tx.vin:
+        scriptSig = v.scriptSig
+        yield v.prevout.serialize() + serialize.ser_compact_size(len(scriptSig)), False
+        yield scriptSig[:-1], True
+        yield scriptSig[-1:] + struct.pack('<I', v.nSequence), False
+    yield serialize.ser_compact_size(len(tx.vout)), False
+    for v in tx.vout:
+        scriptPubKey = v.scriptPubKey
+        yield struct.pack('<q', v.nValue) + serialize.ser_compact_size(len(scriptPubKey)), False
+        yield scriptPubKey, True
+    yield struct.pack('<I', tx.nLockTime), False
+
+def pack_trusted_input(tx):
+    chunks = []
+    buf = bytearray()
+    room = _TRUSTED_INPUT_FIRST
+
+    for b, splittable in _trusted_input_segments(tx):
+        if not splittable and len(b) > room - len(buf):
+            chunks.append(bytes(buf))
+            buf = bytearray()
+            room = _TRUSTED_INPUT_NEXT
+
+        while len(b) > room - len(buf):
+            n = room - len(buf)
+            buf += b[:n]
+            b = b[n:]
+            chunks.append(bytes(buf))
+            buf = bytearray()
+            room = _TRUSTED_INPUT_NEXT
+
+        buf += b
+
+    chunks.append(bytes(buf))
+    return chunks
+
+def get_trusted_input(tx, n):
+    chunks = pack_trusted_input(tx)
+
+    r = ledger.call_get_trusted_input_first(n, chunks[0])
+    for i in range(1, len(chunks)):
+        if r != b'':
+            raise RuntimeError('get_trusted_input (%d): %s' % (i - 1, r))
+        r = ledger.call_get_trusted_input_next(chunks[i])
+
+    if r == b'':
+        raise RuntimeError('bad trusted input response')
+
+    return r
+
+# Trusted input blobs are authenticated with a key held by the device, so
+# one obtained in this device session stays valid for the rest of it.
+# Keeping them means retrying a send (after a rejection on the device, or
+# with different outputs) does not upload the previous transactions again.
+
+_trusted_input_d = {}
+
+def _trusted_input_key(txid, n):
+    ledger.get_dongle()
+    return (ledger.get_session_id(), txid, n)
+
+def get_cached_trusted_input(txid, n):
+    return _trusted_input_d.get(_trusted_input_key(txid, n))
+
+def put_cached_trusted_input(txid, n, d):
+    key = _trusted_input_key(txid, n)
+
+    # blobs from earlier sessions are of no further use
+    for k in [k for k in _trusted_input_d.keys() if k[0] != key[0]]:
+        del _trusted_input_d[k]
+
+    _trusted_input_d[key] = d
+
+def clear_trusted_inputs():
+    _trusted_input_d.clear()
+
 def sign_tx(tx_in, address_d, change_path = None, txid_d = None):
+    # if the ledger connection drops partway through a sequence, start
+    # over (once) in a new session
+    try:
+        return _sign_tx(tx_in, address_d, change_path, txid_d)
+    except ledger.TransportError as e:
+        sys.stdout.write('\n%s; starting over\n' % e); sys.stdout.flush()
+    return _sign_tx(tx_in, address_d, change_path, txid_d)
+
+def _sign_tx(tx_in, address_d, change_path = None, txid_d = None):
     tx = CTransaction(tx_in)
 
     # First, we need a trusted input blob for each vin[i].
     sys.stdout.write('Loading input transactions (%d)...  ' % len(tx.vin)); sys.stdout.flush()
+
+    # fetch the previous transactions not yet uploaded all at once
+    if txid_d is None:
+        txcache.get_hex_transactions([serialize.b2hs(v.prevout.hash[::-1]) for v in tx.vin if get_cached_trusted_input(serialize.b2hs(v.prevout.hash[::-1]), v.prevout.n) is None])
+
     til = []
     for i in range(len(tx.vin)):
-        d = {}
 
         # get the txid for the output this input refers to
         txid = tx.vin[i].prevout.hash
@@ -247,46 +488,23 @@ def sign_tx(tx_in, address_d, change_path = None, txid_d = None):
         # and the index into vout
         n = tx.vin[i].prevout.n
 
-        # get the transaction from energid
-        tx_i_hex = eel.get_hex_transaction(txid_hs) if txid_d is None else txid_d[txid_hs]['hex']
-        tx_i = CTransaction().deserialize(BytesIO(serialize.hs2b(tx_i_hex)))
+        # already uploaded in this session?
+        d = get_cached_trusted_input(txid_hs, n)
+        if d is not None:
+            til.append(d)
+            continue
+
+        # get the transaction (cached, or from energid)
+        tx_i_hex = txcache.get_hex_transaction(txid_hs) if txid_d is None else txid_d[txid_hs]['hex']
+        tx_i = CTransaction().deserialize(serialize.ByteReader(serialize.hs2b(tx_i_hex)))
+
+        d = {}
 
         # save scriptPubKey for later
         d['scriptPubKey'] = tx_i.vout[n].scriptPubKey
 
-        # we'll send this in chunks; the first includes up to vin len
-        buf = struct.pack('<i', tx_i.nVersion) + serialize.ser_compact_size(len(tx_i.vin))
-        r = ledger.call_get_trusted_input_first(n, buf)
-        if r != b'':
-            raise RuntimeError('get_trusted_input_first: %s' % r)
-
-        # now send vin
-        for j in range(len(tx_i.vin)):
-            buf = tx_i.vin[j].serialize()
-            r = ledger.call_get_trusted_input_next(buf)
-            if r != b'':
-                raise RuntimeError('get_trusted_input_next: %s' % r)
-
-        # send len of vout and vout[0]
-        buf = serialize.ser_compact_size(len(tx_i.vout)) + tx_i.vout[0].serialize()
-        r = ledger.call_get_trusted_input_next(buf)
-        if r != b'':
-            raise RuntimeError('get_trusted_input_next (0): %s' % (r))
-
-        # send the rest of vout
-        for j in range(1, len(tx_i.vout)):
-            buf = tx_i.vout[j].serialize()
-            r = ledger.call_get_trusted_input_next(buf)
-            if r != b'':
-                raise RuntimeError('get_trusted_input_next (%d): %s' % (j, r))
-
-        # send locktime
-        buf = struct.pack('<I', tx_i.nLockTime)
-        r = ledger.call_get_trusted_input_next(buf)
-        if r == b'':
-            raise RuntimeError('bad trusted input response')
-
-        d['tib'] = r
+        d['tib'] = get_trusted_input(tx_i, n)
+        put_cached_trusted_input(txid_hs, n, d)
         til.append(d)
 
     # Second, we need a signature to put in each vin[i].scriptSig.
@@ -326,7 +544,7 @@ def sign_tx(tx_in, address_d, change_path = None, txid_d = None):
         # everything but the very last one
         for b in bufl[:-1]:
             r = ledger.call_hash_input_finalize_full(b)
-            if b'' != r:
+            if r not in (b'', b'\x00'):
                 raise RuntimeError('hash_input_finalize_full: %s' % r)
 
         # register the change path if we have it
@@ -1,7 +1,11 @@
+import concurrent.futures
+import os
+import threading
 import time
 
 from coinapi import eelocal as eel
-from lwallet import energi, ledger
+from lwallet import bip32, energi, ledger
+from lwallet.codec import b2s, s2b
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
@@ -21,9 +25,10 @@ from lwallet import energi, ledger
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
 def get_all_utxos(addr_l, verbose = False):
+    utxo_d = eel.get_unspent_many([a['address'] for a in addr_l])
     rd = {}
     for a in addr_l:
-        ul = eel.get_unspent(a['address'])
+        ul = utxo_d[a['address']]
         if verbose:
             print('utxos for address %s: %s' % (a['address'], ul))
         a['utxos'] = ul
@@ -32,7 +37,7 @@ def get_all_utxos(addr_l, verbose = False):
 
 def is_unused(a):
     if isinstance(a, bytes):
-        a = u''.join(['%c' % c for c in a])
+        a = b2s(a)
     try:
         return len(eel.get_address_txids(a)) == 0
     except Exception as e:
@@ -44,6 +49,84 @@ def address_entry(address, uncompressed_address, public_key, purpose = 44, coin
             'purpose': purpose, 'coin': coin, 'account': account, 'change': change, 'index': index,
             'path': 'm/%d\'/%d\'/%d\'/%d/%d' % (purpose, coin, account, change, index)}
 
+# With LWALLET_LOCAL_DERIVATION set, the extended public key (public key
+# and chain code) of m/44'/9797'/account' is fetched from the ledger once,
+# and the non-hardened change/index keys below it are derived locally.
+# The ledger is then only needed for signing.
+
+_xpub_d = {}
+
+def local_derivation():
+    return os.environ.get('LWALLET_LOCAL_DERIVATION', '') not in ('', '0')
+
+def get_account_xpub(account = 0):
+    # kept for as long as the ledger session (so the same device) lasts
+    ledger.get_dongle()
+    session, public_key, chaincode = _xpub_d.get(account, (None, None, None))
+    if session != ledger.get_session_id():
+        public_key, chaincode = ledger.get_public_key_chaincode(energi.serialize_account_pathd(energi.create_pathd(account = account)))
+
+        # check the derivation against the ledger once before trusting it
+        keypath = energi.serialize_pathd(energi.create_pathd(account = account))
+        if bip32.derive_pub(public_key, chaincode, [0, 0], compressed = False)[0] != ledger.get_public_key(keypath):
+            raise RuntimeError('local derivation does not match the ledger')
+
+        _xpub_d[account] = (ledger.get_session_id(), public_key, chaincode)
+    return public_key, chaincode
+
+# The public keys cached in wallet.db are only good for the device they
+# came from, so they are stored with the public key of their account.
+# Once per ledger session that is compared with what the device has, and
+# on a mismatch (another device, or a restore from another seed) the
+# cached keys of the account are dropped.
+
+_pubkey_checked_d = {}
+_pubkey_lock = threading.Lock()
+
+def _check_pubkey_cache(account):
+    from lwallet import walletdb
+
+    with _pubkey_lock:
+        # (opening the device first, so a reopened one counts as a new session)
+        ledger.get_dongle()
+        if _pubkey_checked_d.get(account) == ledger.get_session_id():
+            return
+
+        public_key = ledger.get_public_key(energi.serialize_account_pathd(energi.create_pathd(account = account)))
+        if walletdb.get_pubkey_account_db(account) != public_key:
+            walletdb.reset_pubkey_account_db(account, public_key)
+        _pubkey_checked_d[account] = ledger.get_session_id()
+
+def clear_pubkey_cache():
+    from lwallet import walletdb
+
+    with _pubkey_lock:
+        walletdb.nuke_pubkey_db()
+        _pubkey_checked_d.clear()
+        _xpub_d.clear()
+
+def derive(account = 0, change = 0, index = 0):
+    from lwallet import walletdb
+
+    # public keys never change for a path, so only ask the ledger once
+    _check_pubkey_cache(account)
+    pe = walletdb.get_pubkey_db(account, change, index)
+    if pe is not None:
+        return pe['public_key'], pe['address'], pe['uncompressed_address']
+
+    if local_derivation():
+        public_key, chaincode = get_account_xpub(account)
+        public_key = bip32.derive_pub(public_key, chaincode, [change, index], compressed = False)[0]
+    else:
+        keypath = energi.serialize_pathd(energi.create_pathd(index = index, change = change, account = account))
+        public_key = ledger.get_public_key(keypath)
+
+    address = energi.encode_address(energi.compress_public_key(public_key))
+    uncompressed_address = energi.encode_address(public_key)
+
+    walletdb.put_pubkey_db(account, change, index, public_key, address, uncompressed_address)
+    return public_key, address, uncompressed_address
+
 def get_address(ae, display = False):
     keypath = energi.serialize_pathd(ae)
     public_key = ledger.get_public_key(keypath, display)
@@ -56,10 +139,7 @@ def get_next_unused(index = 0, n = 1, account = 0):
     i = index
     rl = []
     while count < n:
-        keypath = energi.serialize_pathd(energi.create_pathd(index = i, account = 0))
-        public_key = ledger.get_public_key(keypath)
-        address = energi.encode_address(energi.compress_public_key(public_key))
-        uncompressed_address = energi.encode_address(public_key)
+        public_key, address, uncompressed_address = derive(account = 0, index = i)
 
         if is_unused(address) and is_unused(uncompressed_address):
             rl.append(address_entry(address, uncompressed_address, public_key, index = i, account = account))
@@ -72,80 +152,123 @@ def get_next_unused(index = 0, n = 1, account = 0):
 def get_next_change(for_index, account = 0):
     i = 1
     while True:
-        keypath = energi.serialize_pathd(energi.create_pathd(index = for_index, change = i, account = account))
-        public_key = ledger.get_public_key(keypath)
-        address = energi.encode_address(energi.compress_public_key(public_key))
-        uncompressed_address = energi.encode_address(public_key)
+        public_key, address, uncompressed_address = derive(account = account, change = i, index = for_index)
 
         if is_unused(address) and is_unused(uncompressed_address):
             return address_entry(address, uncompressed_address, public_key, index = for_index, change = i, account = account)
 
         i += 1
 
-def get_all_used_change(for_index, threshold = 1, account = 0, verbose = False):
-    addresses = []
-    missing = 0
-    change = 1
-    while missing <= threshold:
-        keypath = energi.serialize_pathd(energi.create_pathd(index = for_index, change = change, account = account))
-        public_key = ledger.get_public_key(keypath)
-        address = energi.encode_address(energi.compress_public_key(public_key))
-        uncompressed_address = energi.encode_address(public_key)
-
-        if not is_unused(address) or not is_unused(uncompressed_address):
-            ae = address_entry(address, uncompressed_address, public_key, change = change, index = for_index, account = account)
-            if verbose:
-                print('found used: %s' % ae['path'])
-            addresses.append(ae)
-            missing = 0
+# Discovery checks addresses in windows, one RPC per window.  A window is
+# as small as the gap threshold allows and doubles (up to DISCOVERY_WINDOW)
+# while it keeps finding used addresses, so sparse chains cost no extra
+# derivations and dense ones only a few calls.
 
-        missing += 1
-        change += 1
+DISCOVERY_WINDOW = 20
 
-    return addresses
+# Change chains are scanned on this many threads while the main chain is
+# still being walked.
 
-def b2s(b):
-    return ''.join(['%c' % c for c in b])
+DISCOVERY_WORKERS = 4
 
-def get_all_used_addresses(threshold = 1, account = 0, verbose = False, index = 0):
+def _find_used(probe, account, threshold, verbose, on_found = None):
+    """
+        probe(i) gives the (change, index) of the i-th path to check.  Stops
+        once more than threshold paths in a row are unused.  on_found, if
+        given, gets each window's used addresses as soon as they are known.
+    """
     addresses = []
     missing = 0
+    i = 0
+    window = 1
     while missing <= threshold:
-        keypath = energi.serialize_pathd(energi.create_pathd(account = account, index = index))
-        public_key = ledger.get_public_key(keypath)
-        address = energi.encode_address(energi.compress_public_key(public_key))
-        uncompressed_address = energi.encode_address(public_key)
+        n = min(max(window, threshold + 1 - missing), DISCOVERY_WINDOW)
+        paths = [probe(j) for j in range(i, i + n)]
+        keys = [derive(account = account, change = change, index = index) for change, index in paths]
+        used = eel.get_used_addresses([b2s(a) for k in keys for a in k[1:]])
 
-        find_change = False
+        found = []
+        for (change, index), (public_key, address, uncompressed_address) in zip(paths, keys):
+            if missing > threshold:
+                break
 
-        if not is_unused(address) or not is_unused(uncompressed_address):
-            ae = address_entry(address, uncompressed_address, public_key, index = index, account = account)
-            if verbose:
-                print('found used: %s' % ae['path'])
-            addresses.append(ae)
-            missing = 0
-            find_change = True
+            if b2s(address) in used or b2s(uncompressed_address) in used:
+                ae = address_entry(address, uncompressed_address, public_key, change = change, index = index, account = account)
+                if verbose:
+                    print('found used: %s' % ae['path'])
+                found.append(ae)
+                missing = 0
 
-        if find_change:
-            addresses += get_all_used_change(index, threshold, account, verbose)
+            missing += 1
 
-        missing += 1
-        index += 1
+        if len(found) > 0 and on_found is not None:
+            on_found(found)
+
+        addresses += found
+        i += n
+        window = min(2 * window, DISCOVERY_WINDOW) if len(found) > 0 else 1
+
+    return addresses
+
+def get_all_used_change(for_index, threshold = 1, account = 0, verbose = False):
+    return _find_used(lambda i: (1 + i, for_index), account, threshold, verbose)
+
+def get_all_used_addresses(threshold = 1, account = 0, verbose = False, index = 0, workers = DISCOVERY_WORKERS, on_found = None):
+    """
+        Each used index's change chain is scanned on a thread pool as soon
+        as the index is found.  on_found, if given, is called (from this
+        thread) with every batch of used addresses as it comes in; the list
+        returned is in the usual order, each index followed by its change.
+    """
+    from lwallet import walletdb
+
+    used_l = []
+    change_d = {}
+    pending = {}
+
+    def scan_change(for_index):
+        # derive() opens a sqlite connection on the pool thread; close it
+        try:
+            return get_all_used_change(for_index, threshold, account, verbose)
+        finally:
+            walletdb.db_close()
+
+    def collect(block):
+        done = concurrent.futures.as_completed(list(pending)) if block else [f for f in pending if f.done()]
+        for f in done:
+            change_l = f.result()
+            change_d[pending.pop(f)] = change_l
+            if len(change_l) > 0 and on_found is not None:
+                on_found(change_l)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, workers)) as ex:
+        def found(ael):
+            used_l.extend(ael)
+            for ae in ael:
+                pending[ex.submit(scan_change, ae['index'])] = ae['index']
+            if on_found is not None:
+                on_found(ael)
+            collect(False)
+
+        _find_used(lambda i: (0, index + i), account, threshold, verbose, found)
+        collect(True)
+
+    addresses = []
+    for ae in used_l:
+        addresses.append(ae)
+        addresses += change_d[ae['index']]
 
     return addresses
 
 def search_address_path(address_in, account = 0):
     if isinstance(address_in, str):
-        address_in = bytes([ord(c) for c in address_in])
+        address_in = s2b(address_in)
 
     index = 0
     change = 0
     state = 0
     while True:
-        keypath = energi.serialize_pathd(energi.create_pathd(index = index, change = change, account = account))
-        public_key = ledger.get_public_key(keypath)
-        address = energi.encode_address(energi.compress_public_key(public_key))
-        uncompressed_address = energi.encode_address(public_key)
+        public_key, address, uncompressed_address = derive(account = account, change = change, index = index)
 
         if address_in == address or address_in == uncompressed_address:
             return energi.create_pathd(index = index, change = change, account = account)
@@ -166,8 +289,8 @@ def search_address_path(address_in, account = 0):
                 change += 1
 
 
-def get_address_d(threshold = 1, verbose = False):
-    addr_l = get_all_used_addresses(threshold = threshold, verbose = verbose)
+def get_address_d(threshold = 1, verbose = False, on_found = None):
+    addr_l = get_all_used_addresses(threshold = threshold, verbose = verbose, on_found = on_found)
     addr_d = get_all_utxos(addr_l, verbose = verbose)
 
     index = 0
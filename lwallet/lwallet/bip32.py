@@ -0,0 +1,61 @@
+import hashlib
+import hmac
+import struct
+
+import secp256k1
+
+# BIP32 hierarchical deterministic keys.  Keys are raw bytes: 32 byte private
+# keys and 33 byte compressed public keys; every derivation step also
+# carries a 32 byte chain code.
+
+HARDENED = 0x80000000
+
+# -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+def _hmac_sha512(key, data):
+    I = hmac.new(key, data, hashlib.sha512).digest()
+    return I[:32], I[32:]
+
+def parse_keypath(b):
+    """
+        Keypath as sent to the ledger (a count byte followed by that many
+        big-endian indexes) to a list of indexes.
+    """
+    n = b[0]
+    if len(b) < 1 + 4 * n:
+        raise RuntimeError('keypath too short')
+    return list(struct.unpack('>%dI' % n, bytes(b[1:1 + 4 * n])))
+
+def public_key(k, compressed = True):
+    return secp256k1.PrivateKey(k, raw = True).pubkey.serialize(compressed = compressed)
+
+def master_key(seed):
+    return _hmac_sha512(b'Bitcoin seed', seed)
+
+def ckd_priv(k, c, i):
+    if i & HARDENED:
+        data = b'\x00' + k + struct.pack('>I', i)
+    else:
+        data = public_key(k) + struct.pack('>I', i)
+
+    IL, IR = _hmac_sha512(c, data)
+    return secp256k1.PrivateKey(k, raw = True).tweak_add(IL), IR
+
+def ckd_pub(K, c, i):
+    if i & HARDENED:
+        raise RuntimeError('cannot derive a hardened child from a public key')
+
+    K = secp256k1.PublicKey(bytes(K), raw = True)
+    IL, IR = _hmac_sha512(c, K.serialize(compressed = True) + struct.pack('>I', i))
+    return K.tweak_add(IL).serialize(compressed = True), IR
+
+def derive_pub(K, c, path, compressed = True):
+    for i in path:
+        K, c = ckd_pub(K, c, i)
+    return secp256k1.PublicKey(K, raw = True).serialize(compressed = compressed), c
+
+def derive_priv(seed, path):
+    k, c = master_key(seed)
+    for i in path:
+        k, c = ckd_priv(k, c, i)
+    return k, c
@@ -0,0 +1,16 @@
+import binascii
+
+# Conversions between bytes, hex strings and (latin-1) strings.  Everything
+# else in lwallet delegates to these.
+
+def b2hs(b):
+    return binascii.hexlify(b if isinstance(b, (bytes, bytearray, memoryview)) else bytes(b)).decode()
+
+def hs2b(hs):
+    return binascii.unhexlify(hs)
+
+def b2s(b):
+    return b if isinstance(b, str) else bytes(b).decode('latin-1')
+
+def s2b(s):
+    return s if isinstance(s, bytes) else s.encode('latin-1')
@@ -0,0 +1,375 @@
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+
+import secp256k1
+from ledgerblue.commException import CommException
+
+from lwallet import bip32, energi, ledger
+from lwallet.codec import hs2b, s2b
+
+# A software stand-in for a Ledger running the Energi app, for benchmarking
+# and testing without a device.  It answers the APDUs lwallet sends (see
+# ledger.py) the way ledger-app-energi does, including its limits on how a
+# transaction may be split across APDUs, with keys derived from a seed.
+# ledger.get_dongle() returns one when LWALLET_EMULATOR is set:
+#
+#   LWALLET_EMULATOR=1               use the emulator instead of a device
+#   LWALLET_EMULATOR_SEED=<hex>      BIP32 seed (default: a fixed test seed)
+#   LWALLET_EMULATOR_LATENCY=<secs>  delay added to every APDU (default 0)
+#
+# The default seed is public; never send real funds to its addresses.
+
+DEFAULT_SEED = hashlib.sha256(b'lwallet emulator').digest()
+
+SW_OK                               = 0x9000
+SW_INCORRECT_LENGTH                 = 0x6700
+SW_CONDITIONS_OF_USE_NOT_SATISFIED  = 0x6985
+SW_INCORRECT_DATA                   = 0x6a80
+SW_INCORRECT_P1_P2                  = 0x6b00
+SW_INS_NOT_SUPPORTED                = 0x6d00
+SW_CLA_NOT_SUPPORTED                = 0x6e00
+SW_TECHNICAL_PROBLEM                = 0x6f00
+
+MAGIC_TRUSTED_INPUT = 0x32
+SIGHASH_ALL         = 0x01
+
+# -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+class _Status(Exception):
+    def __init__(self, sw):
+        self.sw = sw
+
+# transaction_parse() states
+_NONE, _WAIT_INPUT, _INPUT_SCRIPT, _INPUT_DONE, _WAIT_OUTPUT, _OUTPUT_SCRIPT, _OUTPUT_DONE, _PRESIGN_READY, _PARSED = range(9)
+
+class _TransactionParser:
+    """
+        Follows transaction_parse() in btchip_transaction.c: the transaction
+        arrives as a byte stream over several APDUs, but a field read with
+        check_transaction_available() or transaction_get_varint() must be
+        complete within the current APDU.
+
+        In trusted input mode the whole transaction is parsed and the amount
+        of output `target' is kept.  In signature mode each input is a
+        trusted input blob, and parsing stops after the inputs.
+    """
+
+    def __init__(self, hmac_key, target = None):
+        self.hmac_key = hmac_key
+        self.target = target
+        self.state = _NONE
+        self.h = hashlib.sha256()
+        self.amount = None
+
+    def _need(self, n):
+        if len(self.d) - self.p < n:
+            raise _Status(SW_TECHNICAL_PROBLEM)
+
+    def _take(self, n, hashed = True):
+        self._need(n)
+        b = self.d[self.p:self.p + n]
+        if hashed:
+            self.h.update(b)
+        self.p += n
+        return b
+
+    def _varint(self):
+        self._need(1)
+        n = { 0xfd: 3, 0xfe: 5, 0xff: 9 }.get(self.d[self.p], 1)
+        b = self._take(n)
+        return b[0] if n == 1 else int.from_bytes(b[1:], 'little')
+
+    def _left(self):
+        return len(self.d) - self.p
+
+    def _trusted_input(self):
+        # flag, length and the blob itself; the prevout in it is hashed
+        self._need(2)
+        if self.d[self.p] != 0x01:
+            raise _Status(SW_TECHNICAL_PROBLEM)
+        tib = self._take(2 + self.d[self.p + 1], hashed = False)[2:]
+        if len(tib) != 56 or tib[0] != MAGIC_TRUSTED_INPUT:
+            raise _Status(SW_TECHNICAL_PROBLEM)
+        if not hmac.compare_digest(hmac.new(self.hmac_key, tib[:48], hashlib.sha256).digest()[:8], tib[48:]):
+            raise _Status(SW_TECHNICAL_PROBLEM)
+        self.h.update(tib[4:40])
+
+    def feed(self, d):
+        self.d = d
+        self.p = 0
+
+        while True:
+            if self.state == _NONE:
+                self._take(4)
+                self.remaining = self._varint()
+                self.state = _WAIT_INPUT
+
+            elif self.state == _WAIT_INPUT:
+                if self.remaining == 0:
+                    self.state = _INPUT_DONE if self.target is not None else _PRESIGN_READY
+                    continue
+                if self._left() < 1:
+                    return
+                if self.target is not None:
+                    self._take(36)
+                else:
+                    self._trusted_input()
+                self.script = self._varint()
+                self.state = _INPUT_SCRIPT
+
+            elif self.state == _INPUT_SCRIPT:
+                if self._left() < 1:
+                    return
+                if self.script == 1:
+                    self._take(1)
+                    self.script = 0
+                if self.script == 0:
+                    self._take(4) # nSequence
+                    self.remaining -= 1
+                    self.state = _WAIT_INPUT
+                    continue
+                n = min(self._left(), self.script - 1)
+                self._take(n)
+                self.script -= n
+
+            elif self.state == _INPUT_DONE:
+                if self._left() < 1:
+                    return
+                self.remaining = self._varint()
+                self.current = 0
+                self.state = _WAIT_OUTPUT
+
+            elif self.state == _WAIT_OUTPUT:
+                if self.remaining == 0:
+                    self.state = _OUTPUT_DONE
+                    continue
+                if self._left() < 1:
+                    return
+                amount = self._take(8)
+                if self.current == self.target:
+                    self.amount = amount
+                self.script = self._varint()
+                self.state = _OUTPUT_SCRIPT
+
+            elif self.state == _OUTPUT_SCRIPT:
+                if self._left() < 1:
+                    return
+                if self.script == 0:
+                    self.remaining -= 1
+                    self.current += 1
+                    self.state = _WAIT_OUTPUT
+                    continue
+                n = min(self._left(), self.script)
+                self._take(n)
+                self.script -= n
+
+            elif self.state == _OUTPUT_DONE:
+                if self._left() < 1:
+                    return
+                self._take(4) # nLockTime
+                if self._left() != 0:
+                    # the app would read extra data here; lwallet never sends any
+                    raise _Status(SW_TECHNICAL_PROBLEM)
+                self.state = _PARSED
+
+            else:
+                if self._left() != 0:
+                    raise _Status(SW_TECHNICAL_PROBLEM)
+                return
+
+# -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+def _keypair(seed, keypath):
+    return bip32.derive_priv(seed, bip32.parse_keypath(keypath))
+
+def _sign(k, h):
+    # DER signature; like the app, the parity of R goes in the first byte
+    key = secp256k1.PrivateKey(k, raw = True)
+    rsig = key.ecdsa_sign_recoverable(h, raw = True)
+    recid = key.ecdsa_recoverable_serialize(rsig)[1]
+    der = key.ecdsa_serialize(key.ecdsa_recoverable_convert(rsig))
+    return bytes([der[0] | (recid & 1)]) + der[1:]
+
+class Emulator:
+    """
+        Same interface as a ledgerblue dongle: exchange() takes an APDU and
+        returns the response data, or raises CommException with the status
+        word.
+    """
+
+    def __init__(self, seed = DEFAULT_SEED, latency = 0.0):
+        self.seed = seed
+        self.latency = latency
+        self.hmac_key = hashlib.sha256(b'trusted input' + seed).digest()
+        self.lock = threading.Lock()
+        self.apdu_count = 0
+
+        self.trusted = None
+        self.signing = None
+        self.outputs = None
+        self.sign_ready = False
+
+        self._handlers = {
+            ledger.INS_GET_WALLET_PUBLIC_KEY:       self._get_wallet_public_key,
+            ledger.INS_GET_TRUSTED_INPUT:           self._get_trusted_input,
+            ledger.INS_HASH_INPUT_START:            self._hash_input_start,
+            ledger.INS_HASH_INPUT_FINALIZE_FULL:    self._hash_input_finalize_full,
+            ledger.INS_HASH_SIGN:                   self._hash_sign,
+            ledger.INS_SIGN_MNB:                    self._sign_mnb
+        }
+
+    def exchange(self, apdu, timeout = 20000):
+        with self.lock:
+            self.apdu_count += 1
+            if self.latency > 0:
+                time.sleep(self.latency)
+
+            apdu = bytes(apdu)
+            try:
+                if len(apdu) < 5 or len(apdu) != 5 + apdu[4]:
+                    raise _Status(SW_INCORRECT_LENGTH)
+                if apdu[0] != ledger.CLA:
+                    raise _Status(SW_CLA_NOT_SUPPORTED)
+                if apdu[1] not in self._handlers:
+                    raise _Status(SW_INS_NOT_SUPPORTED)
+                r = self._handlers[apdu[1]](apdu[2], apdu[3], apdu[5:])
+            except _Status as e:
+                raise CommException('Invalid status %04x' % e.sw, e.sw, b'')
+            return bytearray(r)
+
+    def close(self):
+        pass
+
+    # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+    def _get_wallet_public_key(self, p1, p2, data):
+        if len(data) < 1:
+            raise _Status(SW_INCORRECT_LENGTH)
+        k, c = _keypair(self.seed, data)
+        public_key = bip32.public_key(k, compressed = False)
+        address = s2b(energi.address_repr(energi.hash160(bip32.public_key(k)), energi.NRG_COIN_ID))
+        return bytes([len(public_key)]) + public_key + bytes([len(address)]) + address + c
+
+    def _get_trusted_input(self, p1, p2, data):
+        if p1 == 0x00:
+            if len(data) < 4:
+                raise _Status(SW_INCORRECT_LENGTH)
+            self.trusted = _TransactionParser(self.hmac_key, struct.unpack('>I', data[:4])[0])
+            data = data[4:]
+        elif p1 != 0x80 or self.trusted is None:
+            raise _Status(SW_INCORRECT_P1_P2)
+        if p2 != 0x00:
+            raise _Status(SW_INCORRECT_P1_P2)
+
+        t = self.trusted
+        try:
+            t.feed(data)
+        except _Status:
+            self.trusted = None
+            raise
+
+        if t.state != _PARSED:
+            return b''
+
+        self.trusted = None
+        if t.amount is None:
+            raise _Status(SW_INCORRECT_DATA)
+
+        tib = bytes([MAGIC_TRUSTED_INPUT, 0x00]) + os.urandom(2)
+        tib += hashlib.sha256(t.h.digest()).digest() + struct.pack('<I', t.target) + t.amount
+        return tib + hmac.new(self.hmac_key, tib, hashlib.sha256).digest()[:8]
+
+    def _hash_input_start(self, p1, p2, data):
+        if p1 == 0x00:
+            self.signing = _TransactionParser(self.hmac_key)
+            self.outputs = None
+            self.sign_ready = False
+        elif p1 != 0x80 or self.signing is None:
+            raise _Status(SW_INCORRECT_P1_P2)
+
+        try:
+            self.signing.feed(data)
+        except _Status:
+            self.signing = None
+            raise
+
+        return b''
+
+    def _hash_input_finalize_full(self, p1, p2, data):
+        if self.signing is None or self.signing.state != _PRESIGN_READY:
+            self.signing = None
+            raise _Status(SW_CONDITIONS_OF_USE_NOT_SATISFIED)
+
+        if p1 == 0xff:
+            # change path; only checked for being a keypath
+            bip32.parse_keypath(data)
+            return b''
+
+        if p1 not in (0x00, 0x80):
+            raise _Status(SW_INCORRECT_P1_P2)
+
+        self.outputs = (self.outputs or b'') + data
+        self.signing.h.update(data)
+
+        if p1 == 0x00:
+            return b'\x00'
+
+        self.sign_ready = True
+        return b'\x00\x00'
+
+    def _hash_sign(self, p1, p2, data):
+        if p1 != 0x00 or p2 != 0x00:
+            raise _Status(SW_INCORRECT_P1_P2)
+        if len(data) < 1 + 1 + 4 + 1:
+            raise _Status(SW_INCORRECT_LENGTH)
+
+        signing = self.signing
+        self.signing = None
+        if signing is None or not self.sign_ready:
+            raise _Status(SW_CONDITIONS_OF_USE_NOT_SATISFIED)
+        self.sign_ready = False
+
+        o = 1 + 4 * data[0]
+        o += 1 + data[o] # authorization
+        locktime, hashtype = struct.unpack('>IB', data[o:o + 5])
+        if hashtype != SIGHASH_ALL:
+            raise _Status(SW_INCORRECT_DATA)
+
+        signing.h.update(struct.pack('<II', locktime, hashtype))
+        h = hashlib.sha256(signing.h.digest()).digest()
+
+        k, c = _keypair(self.seed, data)
+        return _sign(k, h) + bytes([hashtype])
+
+    def _sign_mnb(self, p1, p2, data):
+        if p1 != 0xa5 or p2 != 0x5a:
+            raise _Status(SW_INCORRECT_P1_P2)
+        if len(data) < 1 or len(data) < 1 + 4 * data[0] + 36 + 16 + 2 + 2 * 33 + 8 + 4:
+            raise _Status(SW_INCORRECT_DATA)
+
+        o = 1 + 4 * data[0]
+        mnb = data[o:]
+
+        # the address must be IPv4 (mapped into IPv6)
+        if mnb[36 + 10] != 0xff or mnb[36 + 11] != 0xff:
+            raise _Status(SW_INCORRECT_DATA)
+
+        h = hashlib.sha256(hashlib.sha256(mnb).digest()).digest()
+
+        k, c = _keypair(self.seed, data)
+        return _sign(k, h)
+
+# -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+def enabled():
+    return os.environ.get('LWALLET_EMULATOR', '') not in ('', '0')
+
+def from_env():
+    seed = os.environ.get('LWALLET_EMULATOR_SEED')
+    seed = hs2b(seed) if seed else DEFAULT_SEED
+    latency = float(os.environ.get('LWALLET_EMULATOR_LATENCY', '0'))
+    return Emulator(seed, latency)
@@ -68,3 +68,11 @@ def serialize_pathd(path):
     hs += '%8.8x' % path['index']
     return hs
 
+# m / 44' / 9797' / account'
+def serialize_account_pathd(path):
+    path_len = 3
+    hs = '%2.2x' % path_len
+    hs += '%8.8x' % ((path['purpose'] if 'purpose' in path else 44) | 0x80000000)
+    hs += '%8.8x' % ((path['coin'] if 'coin' in path else 9797) | 0x80000000)
+    hs += '%8.8x' % (path['account'] | 0x80000000)
+    return hs
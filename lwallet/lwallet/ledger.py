@@ -1,70 +1,180 @@
+import atexit
 import base58
 import hashlib
 import sys
 import struct
+import threading
 
 from ledgerblue.comm import getDongle
 from ledgerblue.commException import CommException
 
+from lwallet.codec import b2hs, hs2b
+
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
 DEBUG = False
 
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
+# All APDUs go through one dongle session which is opened on first use and
+# reopened if the transport fails.  _session_id changes every time a new
+# session is opened.  With LWALLET_EMULATOR set the "dongle" is the software
+# emulator in emulator.py.
+
+_dongle = None
+_session_id = 0
+_lock = threading.RLock()
+
+def _open():
+    from lwallet import emulator
+
+    if emulator.enabled():
+        return emulator.from_env()
+    return getDongle(debug = DEBUG)
+
+def get_dongle():
+    global _dongle
+    global _session_id
+
+    with _lock:
+        if _dongle is None:
+            _dongle = _open()
+            _session_id += 1
+        return _dongle
+
+def get_session_id():
+    return _session_id
+
+def close():
+    global _dongle
+
+    with _lock:
+        if _dongle is not None:
+            try:
+                _dongle.close()
+            finally:
+                _dongle = None
+
+atexit.register(close)
+
+class TransportError(RuntimeError):
+    """
+        The connection failed after an APDU that cannot simply be sent again
+        may have reached the device.  The session is closed; whatever
+        sequence it was part of has to start over.
+    """
+    pass
+
+def _resendable(apdu):
+    # instructions that do not depend on (or change) state in the app, and
+    # the first APDU of a sequence, which resets it
+    if apdu[1] in (INS_GET_WALLET_PUBLIC_KEY, INS_GET_COIN_VERSION, INS_GET_OPERATION_MODE, INS_GET_RANDOM):
+        return True
+    return apdu[1] in (INS_GET_TRUSTED_INPUT, INS_HASH_INPUT_START) and apdu[2] == 0x00
+
+def exchange(apdu):
+    with _lock:
+        # nothing has been sent if the session could not be opened
+        try:
+            dongle = get_dongle()
+        except (IOError, OSError, ValueError):
+            dongle = get_dongle()
+
+        try:
+            return dongle.exchange(apdu)
+        except CommException:
+            # the device answered with an error status; the session is fine
+            raise
+        except (IOError, OSError, ValueError) as e:
+            close()
+            if not _resendable(apdu):
+                raise TransportError('ledger connection lost: %s' % e) from e
+        return get_dongle().exchange(apdu)
+
 class ledger_device:
     def __enter__(self):
-        self.d = getDongle(debug = DEBUG)
+        self.d = get_dongle()
         return self.d
 
     def __exit__(self, type, value, traceback):
-        self.d.close()
+        pass
 
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
-def hs2b(hs):
-    return bytes([int(hs[x:x + 2], 16) for x in range(0, len(hs), 2)])
-
-def b2hs(b):
-    return ''.join(['%2.2x' % c for c in b])
+CLA                             = 0xe0
+INS_GET_COIN_VERSION            = 0x16
+INS_SETUP                       = 0x20
+INS_GET_OPERATION_MODE          = 0x24
+INS_GET_WALLET_PUBLIC_KEY       = 0x40
+INS_GET_RANDOM                  = 0xc0
+INS_GET_TRUSTED_INPUT           = 0x42
+INS_HASH_INPUT_START            = 0x44
+INS_HASH_SIGN                   = 0x48
+INS_HASH_INPUT_FINALIZE_FULL    = 0x4a
+INS_SIGN_MNB                    = 0x50
+
+_asm_d = {
+    'CLA'                           : CLA,
+    'INS_GET_COIN_VERSION'          : INS_GET_COIN_VERSION,
+    'INS_SETUP'                     : INS_SETUP,
+    'INS_GET_OPERATION_MODE'        : INS_GET_OPERATION_MODE,
+    'INS_GET_WALLET_PUBLIC_KEY'     : INS_GET_WALLET_PUBLIC_KEY,
+    'INS_GET_RANDOM'                : INS_GET_RANDOM,
+    'INS_GET_TRUSTED_INPUT'         : INS_GET_TRUSTED_INPUT,
+    'INS_HASH_INPUT_START'          : INS_HASH_INPUT_START,
+    'INS_HASH_SIGN'                 : INS_HASH_SIGN,
+    'INS_HASH_INPUT_FINALIZE_FULL'  : INS_HASH_INPUT_FINALIZE_FULL,
+    'INS_SIGN_MNB'                  : INS_SIGN_MNB
+}
+_disasm_d = { _asm_d[k]: k for k in _asm_d if k != 'CLA' }
+
+_apdu_header = struct.Struct('>BBBBB')
+
+def apdu(ins, p1 = 0, p2 = 0, data = b''):
+    if len(data) > 255:
+        raise RuntimeError('message too long')
+    return _apdu_header.pack(CLA, ins, p1, p2, len(data)) + data
+
+def apdu_repr(a):
+    r = 'CLA' if a[0] == CLA else '%2.2x' % a[0]
+    if len(a) > 1:
+        r += '|' + (_disasm_d[a[1]] if a[1] in _disasm_d else '%2.2x' % a[1])
+    if len(a) > 2:
+        r += '|' + '|'.join(['%2.2x' % c for c in a[2:5]])
+    if len(a) > 5:
+        r += '|' + b2hs(a[5:])
+    return r
 
 def get_apdu(a, debug = False):
-    _asm_d = {
-        'CLA'                           : 'e0',
-        'INS_GET_COIN_VERSION'          : '16',
-        'INS_SETUP'                     : '20',
-        'INS_GET_OPERATION_MODE'        : '24',
-        'INS_GET_WALLET_PUBLIC_KEY'     : '40',
-        'INS_GET_RANDOM'                : 'c0',
-        'INS_GET_TRUSTED_INPUT'         : '42',
-        'INS_HASH_INPUT_START'          : '44',
-        'INS_HASH_SIGN'                 : '48',
-        'INS_HASH_INPUT_FINALIZE_FULL'  : '4a',
-        'INS_SIGN_MNB'                  : '50',
-
-        '|'                             : ''
-    }
-    for k in _asm_d.keys():
-        while k in a:
-            a = a.replace(k, _asm_d[k])
+    """
+        Assemble an APDU written as mnemonics, e.g.
+        'CLA|INS_GET_WALLET_PUBLIC_KEY|00|00|15|<keypath>'.
+    """
+    a = hs2b(''.join([('%2.2x' % _asm_d[t]) if t in _asm_d else t for t in a.split('|')]))
     if debug:
-        print('debug apdu: %s' % a)
-    return hs2b(a)
+        print('debug apdu: %s' % apdu_repr(a))
+    return a
+
+def _keypath_b(keypath):
+    return hs2b(keypath) if isinstance(keypath, str) else keypath
 
 def call(a, debug = False):
-    with ledger_device() as d:
-        return d.exchange(get_apdu(a, debug))
+    if isinstance(a, str):
+        a = get_apdu(a, debug)
+    elif debug:
+        print('debug apdu: %s' % apdu_repr(a))
+    return exchange(a)
 
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
 def call_get_operation_mode():
-    return call('CLA|INS_GET_OPERATION_MODE|00')
+    return call(apdu(INS_GET_OPERATION_MODE))
 
 def call_get_coin_version():
-    return call('CLA|INS_GET_COIN_VERSION')
+    return call(apdu(INS_GET_COIN_VERSION))
 
 def call_get_random(len = 0):
-    return call('CLA|INS_GET_RANDOM|0000|%2.2x' % (len))
+    return call(_apdu_header.pack(CLA, INS_GET_RANDOM, 0, 0, len))
 
 def parse_get_wallet_public_key_response(bpk):
     pubkey_len = bpk[0]
@@ -72,81 +182,63 @@ def parse_get_wallet_public_key_response(bpk):
 
     return pubkey
 
+def parse_get_wallet_public_key_chaincode(bpk):
+    pubkey_len = bpk[0]
+    pubkey = bytes(bpk[1:1 + pubkey_len])
+
+    # skip the address
+    o = 1 + pubkey_len
+    o += 1 + bpk[o]
+
+    return pubkey, bytes(bpk[o:o + 32])
+
 def call_get_wallet_public_key(keypath, display):
-    apdu = 'CLA|INS_GET_WALLET_PUBLIC_KEY|%2.2x|00|%2.2x|%s' % (display, int(len(keypath) / 2), keypath)
-    return call(apdu)
+    return call(apdu(INS_GET_WALLET_PUBLIC_KEY, int(display), 0, _keypath_b(keypath)))
 
 def get_public_key(keypath, display = False):
     r = call_get_wallet_public_key(keypath, display)
     return parse_get_wallet_public_key_response(r)
 
-def call_get_trusted_input_first(ninput, bs):
-    P1_FIRST = '00'
+def get_public_key_chaincode(keypath):
+    r = call_get_wallet_public_key(keypath, False)
+    return parse_get_wallet_public_key_chaincode(r)
 
-    data = struct.pack('>I', ninput) + bs
-    if len(data) > 255:
-        raise RuntimeError('message too long')
+def call_get_trusted_input_first(ninput, bs):
+    P1_FIRST = 0x00
 
-    apdu = 'CLA|INS_GET_TRUSTED_INPUT|%s|00|%2.2x|%s' % (P1_FIRST, len(data), b2hs(data))
-    return call(apdu)
+    return call(apdu(INS_GET_TRUSTED_INPUT, P1_FIRST, 0x00, struct.pack('>I', ninput) + bs))
 
 def call_get_trusted_input_next(bs):
-    if len(bs) > 255:
-        raise RuntimeError('message too long')
-
-    P1_NEXT = '80'
+    P1_NEXT = 0x80
 
-    apdu = 'CLA|INS_GET_TRUSTED_INPUT|%s|00|%2.2x|%s' % (P1_NEXT, len(bs), b2hs(bs))
-    return call(apdu)
+    return call(apdu(INS_GET_TRUSTED_INPUT, P1_NEXT, 0x00, bs))
 
 def call_hash_input_start_first(bs):
-    if len(bs) > 255:
-        raise RuntimeError('message too long')
+    P1_FIRST = 0x00
+    P2_NEW = 0x00
 
-    P1_FIRST = '00'
-    P2_NEW = '00'
-    apdu = 'CLA|INS_HASH_INPUT_START|%s|%s|%2.2x|%s' % (P1_FIRST, P2_NEW, len(bs), b2hs(bs))
-    return call(apdu)
+    return call(apdu(INS_HASH_INPUT_START, P1_FIRST, P2_NEW, bs))
 
 def call_hash_input_start_next(bs):
-    if len(bs) > 255:
-        raise RuntimeError('message too long')
+    P1_NEXT = 0x80
+    P2_CONTINUE = 0x80
 
-    P1_NEXT = '80'
-    P2_CONTINUE = '80'
-    apdu = 'CLA|INS_HASH_INPUT_START|%s|%s|%2.2x|%s' % (P1_NEXT, P2_CONTINUE, len(bs), b2hs(bs))
-    return call(apdu)
+    return call(apdu(INS_HASH_INPUT_START, P1_NEXT, P2_CONTINUE, bs))
 
 def call_hash_input_finalize_full(bs):
-    if len(bs) > 255:
-        raise RuntimeError('message too long')
-
-    P1_MORE = '00'
-    P1_LAST = '80'
-    P1_CHANGEINFO = 'ff'
-    P2_DEFAULT = '00'
+    P1_MORE = 0x00
 
-    apdu = 'CLA|INS_HASH_INPUT_FINALIZE_FULL|%s|00|%2.2x|%s' % (P1_MORE, len(bs), b2hs(bs))
-    return call(apdu)
+    return call(apdu(INS_HASH_INPUT_FINALIZE_FULL, P1_MORE, 0x00, bs))
 
 def call_hash_input_finalize_full_last(bs):
-    if len(bs) > 255:
-        raise RuntimeError('message too long')
-
-    P1_MORE = '00'
-    P1_LAST = '80'
-    P1_CHANGEINFO = 'ff'
-    P2_DEFAULT = '00'
+    P1_LAST = 0x80
 
-    apdu = 'CLA|INS_HASH_INPUT_FINALIZE_FULL|%s|00|%2.2x|%s' % (P1_LAST, len(bs), b2hs(bs))
-    return call(apdu)
+    return call(apdu(INS_HASH_INPUT_FINALIZE_FULL, P1_LAST, 0x00, bs))
 
 def call_hash_input_finalize_full_change(path_hs):
-    P1_CHANGEINFO = 'ff'
-    P2_DEFAULT = '00'
+    P1_CHANGEINFO = 0xff
 
-    apdu = 'CLA|INS_HASH_INPUT_FINALIZE_FULL|%s|00|%2.2x|%s' % (P1_CHANGEINFO, int(len(path_hs) / 2), path_hs)
-    return call(apdu)
+    return call(apdu(INS_HASH_INPUT_FINALIZE_FULL, P1_CHANGEINFO, 0x00, _keypath_b(path_hs)))
 
 def _parse_signature(sig, recoverable):
     recid = sig[0] & 3
@@ -154,10 +246,7 @@ def _parse_signature(sig, recoverable):
     return (sig, recid) if recoverable else sig
 
 def call_hash_sign(bs, recoverable = False):
-    apdu = 'CLA|INS_HASH_SIGN|00|00|%2.2x|%s' % (len(bs), b2hs(bs))
-    return _parse_signature(call(apdu), recoverable)
+    return _parse_signature(call(apdu(INS_HASH_SIGN, 0x00, 0x00, bs)), recoverable)
 
 def call_sign_mnb(keypath, mnb, recoverable = False):
-    apdu = 'CLA|INS_SIGN_MNB|a5|5a|%2.2x|%s%s' % (int(len(keypath)/2) + len(mnb), keypath, b2hs(mnb))
-    return _parse_signature(call(apdu), recoverable)
-
+    return _parse_signature(call(apdu(INS_SIGN_MNB, 0xa5, 0x5a, _keypath_b(keypath) + mnb)), recoverable)
@@ -64,7 +64,7 @@ def disass_bytes(script):
     return r
 
 def disass_hex(script):
-    return disass_bytes(bytes([int(script[x:x + 2], 16) for x in range(0, len(script), 2)]))
+    return disass_bytes(serialize.hs2b(script))
 
 def disass(script):
     valid_hex_chars = '01234567890abcdefABCDEF'
@@ -3,18 +3,49 @@ import hashlib
 import io
 import struct
 
+from lwallet.codec import b2hs, b2s, hs2b
+
 # NOTE: ser and deser are le unless they are appended with be
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
-def b2hs(b):
-    return u''.join([u'%2.2x' % c for c in b])
-
-def b2s(b):
-    return u''.join([u'%c' % c for c in b])
-
-def hs2b(hs):
-    return bytes([int(hs[x:x + 2], 16) for x in range(0, len(hs), 2)])
+class ByteReader:
+    """
+        Read-only cursor over a buffer.  Unlike io.BytesIO, read() returns
+        memoryview slices of the original buffer rather than copies, and
+        fixed-size fields are unpacked in place with struct.unpack_from.
+    """
+
+    def __init__(self, b, offset = 0):
+        self.buf = memoryview(b)
+        self.offset = offset
+
+    def read(self, n):
+        if self.offset + n > len(self.buf):
+            raise RuntimeError('read past end of buffer (%d + %d > %d)' % (self.offset, n, len(self.buf)))
+        r = self.buf[self.offset:self.offset + n]
+        self.offset += n
+        return r
+
+    def unpack(self, st):
+        r = st.unpack_from(self.buf, self.offset)
+        self.offset += st.size
+        return r
+
+    def tell(self):
+        return self.offset
+
+_uint8  = struct.Struct('<B')
+_uint16 = struct.Struct('<H')
+_int32  = struct.Struct('<i')
+_uint32 = struct.Struct('<I')
+_int64  = struct.Struct('<q')
+_uint64 = struct.Struct('<Q')
+
+def _unpack(m, st):
+    if isinstance(m, ByteReader):
+        return m.unpack(st)[0]
+    return st.unpack(m.read(st.size))[0]
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
@@ -28,13 +59,13 @@ def ser_compact_size(l):
     return struct.pack('<BQ', 255, l)
 
 def deser_compact_size(m):
-    t = struct.unpack('<B', m.read(1))[0]
+    t = _unpack(m, _uint8)
     if t == 253:
-        return struct.unpack('<H', m.read(2))[0]
+        return _unpack(m, _uint16)
     if t == 254:
-        return struct.unpack('<I', m.read(4))[0]
+        return _unpack(m, _uint32)
     if t == 255:
-        return struct.unpack('<Q', m.read(8))[0]
+        return _unpack(m, _uint64)
     return t
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
@@ -71,25 +102,25 @@ def ser_int64(i):
     return struct.pack('<q', i)
 
 def deser_int64(m):
-    return struct.unpack('<q', m.read(8))[0]
+    return _unpack(m, _int64)
 
 def ser_uint32(u):
     return struct.pack('<I', u)
 
 def deser_uint32(m):
-    return struct.unpack('<I', m.read(4))[0]
+    return _unpack(m, _uint32)
 
 def ser_int32(n):
     return struct.pack('<i', n)
 
 def deser_int32(m):
-    return struct.unpack('<i', m.read(4))[0]
+    return _unpack(m, _int32)
 
 def ser_uint16(u):
     return struct.pack('<H', u)
 
 def deser_uint16(m):
-    return struct.unpack('<H', m.read(2))[0]
+    return _unpack(m, _uint16)
 
 def ser_bool(b):
     return b'\x01' if b else b'\x00'
@@ -121,6 +152,9 @@ def deser_map_uint256_int(m):
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
 def from_hex(obj, hs):
+    # not a ByteReader: most objects keep what they read, and memoryviews
+    # into the buffer are neither hashable nor safe to keep (only the
+    # transaction classes copy out what they need)
     obj.deserialize(io.BytesIO(hs2b(hs)))
     return obj
 
@@ -0,0 +1,118 @@
+import collections
+import hashlib
+import os
+import threading
+
+from coinapi import eelocal as eel
+from lwallet.codec import b2hs, hs2b
+
+# Raw transactions are immutable, so once fetched they are kept: the most
+# recently used in memory, and all of them on disk as one file per txid.
+# An entry is only ever returned after checking that it hashes to its
+# txid, so a damaged file is simply fetched again.
+
+_cache_dir   = '~/.energidb/txcache'
+_max_entries = 1024
+
+_lock = threading.Lock()
+_lru  = collections.OrderedDict()
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+def _hash256(b):
+    return hashlib.sha256(hashlib.sha256(b).digest()).digest()
+
+def _check_txid(txid):
+    if len(txid) != 64 or any(c not in '0123456789abcdef' for c in txid):
+        raise RuntimeError('bad txid: %s' % txid)
+
+def _path(txid):
+    return os.path.join(os.path.expanduser(_cache_dir), txid)
+
+def _valid(txid, raw):
+    return b2hs(_hash256(raw)[::-1]) == txid
+
+def _remember(txid, tx_hex):
+    with _lock:
+        _lru[txid] = tx_hex
+        _lru.move_to_end(txid)
+        while len(_lru) > _max_entries:
+            _lru.popitem(last = False)
+
+def _load(txid):
+    try:
+        with open(_path(txid), 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+
+    if not _valid(txid, raw):
+        os.remove(_path(txid))
+        return None
+
+    return b2hs(raw)
+
+def _store(txid, raw):
+    os.makedirs(os.path.expanduser(_cache_dir), exist_ok = True)
+
+    # write then rename, so a reader never sees a partial file
+    tmp = '%s.%d.%d' % (_path(txid), os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp, _path(txid))
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+def get_hex_transaction(txid):
+    txid = txid.lower()
+    _check_txid(txid)
+
+    with _lock:
+        if txid in _lru:
+            _lru.move_to_end(txid)
+            return _lru[txid]
+
+    tx_hex = _load(txid)
+    if tx_hex is None:
+        tx_hex = eel.get_hex_transaction(txid)
+        raw = hs2b(tx_hex)
+        if not _valid(txid, raw):
+            raise RuntimeError('transaction returned for %s does not match its txid' % txid)
+        _store(txid, raw)
+
+    _remember(txid, tx_hex)
+    return tx_hex
+
+def get_hex_transactions(txid_l):
+    rd = {}
+    missing = []
+    for txid in txid_l:
+        txid = txid.lower()
+        _check_txid(txid)
+        with _lock:
+            tx_hex = _lru.get(txid)
+        if tx_hex is None:
+            tx_hex = _load(txid)
+            if tx_hex is None:
+                if txid not in missing:
+                    missing.append(txid)
+                continue
+            _remember(txid, tx_hex)
+        rd[txid] = tx_hex
+
+    # everything not cached in one request
+    if len(missing) > 0:
+        fetched = eel.get_hex_transactions(missing)
+        for txid in missing:
+            raw = hs2b(fetched[txid])
+            if not _valid(txid, raw):
+                raise RuntimeError('transaction returned for %s does not match its txid' % txid)
+            _store(txid, raw)
+            _remember(txid, fetched[txid])
+            rd[txid] = fetched[txid]
+
+    return rd
+
+def clear():
+    with _lock:
+        _lru.clear()
@@ -1,43 +1,131 @@
+import atexit
 import os
 import sqlite3 as lite
+import threading
 
 from coinapi import eelocal as eel
-from lwallet import energi, address
+from lwallet import energi, address, serialize
+from lwallet.codec import b2hs, hs2b
 
 _db_dir = '~/.energidb'
 _db     = 'wallet.db'
 
+# One long-lived connection per thread.  sqlite3 keeps a per-connection
+# cache of compiled statements, so keeping the connection open also means
+# the statements below are only prepared once.
+_local = threading.local()
+_cached_statements = 256
+
+def _db_file():
+    return os.path.join(os.path.expanduser(_db_dir), _db)
+
+# Schema migrations, applied in order.  PRAGMA user_version records how
+# many have been applied, so existing wallet.db files (version 0) are
+# upgraded in place the first time they are opened.
+_migrations = [
+    # 1: base tables
+    [
+        'CREATE TABLE IF NOT EXISTS wallet(address TEXT PRIMARY KEY, pubkey TEXT, pkh TEXT, watchonly INT, ismasternode INT, account INT, path_index INT, change INT)',
+        'CREATE TABLE IF NOT EXISTS unspent(address TEXT, txid TEXT, nout INT, script TEXT, satoshis INT)',
+        'CREATE TABLE IF NOT EXISTS locked(txid TEXT, nout INT)'
+    ],
+
+    # 2: indexes; outpoints are unique, so drop any duplicates first
+    [
+        'DELETE FROM unspent WHERE rowid NOT IN (SELECT MIN(rowid) FROM unspent GROUP BY txid, nout)',
+        'DELETE FROM locked WHERE rowid NOT IN (SELECT MIN(rowid) FROM locked GROUP BY txid, nout)',
+        'CREATE INDEX IF NOT EXISTS unspent_address ON unspent(address)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS unspent_outpoint ON unspent(txid, nout)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS locked_outpoint ON locked(txid, nout)'
+    ],
+
+    # 3: public keys (and their addresses) already fetched from the ledger
+    [
+        'CREATE TABLE IF NOT EXISTS pubkeys(account INT, change INT, path_index INT, pubkey BLOB, address TEXT, uncompressed_address TEXT, PRIMARY KEY(account, change, path_index))'
+    ],
+
+    # 4: incremental sync; the newest checkpoint is the block synced to
+    [
+        'CREATE TABLE IF NOT EXISTS sync_checkpoints(height INT PRIMARY KEY, blockhash TEXT)',
+        'CREATE TABLE IF NOT EXISTS sync_journal(height INT, op INT, address TEXT, txid TEXT, nout INT, script TEXT, satoshis INT)',
+        'CREATE INDEX IF NOT EXISTS sync_journal_height ON sync_journal(height)',
+        'CREATE TABLE IF NOT EXISTS sync_addresses(address TEXT PRIMARY KEY, height INT)'
+    ],
+
+    # 5: the account public key the cached pubkeys were derived under
+    [
+        'CREATE TABLE IF NOT EXISTS pubkey_accounts(account INT PRIMARY KEY, pubkey BLOB)'
+    ]
+]
+
+def get_db_version(con):
+    return con.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_db(con):
+    if get_db_version(con) == len(_migrations):
+        return
+
+    with con:
+        con.execute('BEGIN IMMEDIATE')
+        version = get_db_version(con)
+        if version > len(_migrations):
+            raise RuntimeError('database version %d is newer than supported (%d)' % (version, len(_migrations)))
+        for v in range(version, len(_migrations)):
+            for sql in _migrations[v]:
+                con.execute(sql)
+        con.execute('PRAGMA user_version = %d' % len(_migrations))
+
 def create_db():
     db_dir = os.path.expanduser(_db_dir)
     if not os.path.isdir(db_dir):
         os.mkdir(db_dir)
-    db_file = os.path.join(db_dir, _db)
+    db_file = _db_file()
     if os.path.exists(db_file):
         raise Exception('database exists')
 
-    # create table
-    with lite.connect(db_file) as con:
-        cur = con.cursor()
-        cur.execute('CREATE TABLE wallet(address TEXT PRIMARY KEY, pubkey TEXT, pkh TEXT, watchonly INT, ismasternode INT, account INT, path_index INT, change INT)')
-        cur.execute('CREATE TABLE unspent(address TEXT, txid TEXT, nout INT, script TEXT, satoshis INT)')
-        cur.execute('CREATE TABLE locked(txid TEXT, nout INT)')
-        con.commit()
+    con = lite.connect(db_file)
+    migrate_db(con)
+    con.close()
 
 def db_get_con():
-    db_dir = os.path.expanduser(_db_dir)
-    db_file = os.path.join(db_dir, _db)
+    con = getattr(_local, 'con', None)
+    if con is not None:
+        return con
+
+    db_file = _db_file()
     if not os.path.isfile(db_file):
         create_db()
-    return lite.connect(db_file)
+    con = lite.connect(db_file, cached_statements = _cached_statements)
+    con.execute('PRAGMA journal_mode = WAL')
+    migrate_db(con)
+    _local.con = con
+    return con
+
+def db_close():
+    con = getattr(_local, 'con', None)
+    if con is not None:
+        con.close()
+        _local.con = None
+
+atexit.register(db_close)
 
 
 # ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
 
+def wallet_entry(v):
+    return {'address': v[0], 'pubkey': v[1], 'pkh': v[2], 'watchonly': v[3], 'ismasternode': v[4], 'account': v[5], 'index': v[6], 'change': v[7]}
+
+def unspent_entry(v):
+    return {'address': v[0], 'txid': v[1], 'nout': v[2], 'script': v[3], 'satoshis': v[4]}
+
 def wallet_result(l):
-    return [{'address': v[0], 'pubkey': v[1], 'pkh': v[2], 'watchonly': v[3], 'ismasternode': v[4], 'account': v[5], 'index': v[6], 'change': v[7]} for v in l]
+    return [wallet_entry(v) for v in l]
 
 def unspent_result(l):
-    return [{'address': v[0], 'txid': v[1], 'nout': v[2], 'script': v[3], 'satoshis': v[4]} for v in l]
+    return [unspent_entry(v) for v in l]
+
+def pubkey_result(l):
+    return [{'account': v[0], 'change': v[1], 'index': v[2], 'public_key': v[3], 'address': v[4], 'uncompressed_address': v[5]} for v in l]
 
 def locked_result(l):
     return [{'txid': v[0], 'nout': v[1]} for v in l]
@@ -62,7 +150,7 @@ def lock_txid(txid, nout):
 
     with db_get_con() as con:
         cur = con.cursor()
-        cur.execute('INSERT INTO locked VALUES(?, ?)', (txid, nout))
+        cur.execute('INSERT OR IGNORE INTO locked VALUES(?, ?)', (txid, nout))
         con.commit()
 
 def unlock_txid(txid, nout):
@@ -77,6 +165,39 @@ def get_all_locked():
         cur.execute('SELECT * FROM locked')
         return locked_result(cur.fetchall())
 
+def get_locked_set():
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('SELECT txid, nout FROM locked')
+        return set(cur.fetchall())
+
+def remove_locked(addr_d, max_inputs = None, verbose = False):
+    locked = get_locked_set()
+    count = 0
+    for a in addr_d:
+        nul = []
+        for u in addr_d[a].get('utxos', []):
+            if (u['txid'], u['nout']) in locked:
+                if verbose:
+                    print('removing locked: %s' % u)
+                continue
+            if max_inputs is not None and count >= max_inputs:
+                continue
+            nul.append(u)
+            count += 1
+        addr_d[a]['utxos'] = nul
+    return addr_d
+
+def _address_row(ae):
+    return (ae['address'], ae['public_key'], energi.hash160(energi.compress_public_key(ae['public_key'])), 0, 0, ae['account'], ae['index'], ae['change'])
+
+def _put_address_rows(cur, rows):
+    cur.executemany('INSERT INTO wallet VALUES(?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+def put_address_many(ae_l):
+    with db_get_con() as con:
+        _put_address_rows(con.cursor(), [_address_row(ae) for ae in ae_l])
+
 def put_address_db(address, pubkey = b'', pkh = b'', watchonly = 1, ismasternode = 0, account = 0, index = 0, change = 0):
     with db_get_con() as con:
         cur = con.cursor()
@@ -116,9 +237,27 @@ def nuke_wallet_db():
 def put_unspent_db(address, txid, nout, script, satoshis):
     with db_get_con() as con:
         cur = con.cursor()
-        cur.execute('INSERT INTO unspent VALUES(?, ?, ?, ?, ?)', (address, txid, nout, script, satoshis))
+        cur.execute('INSERT OR REPLACE INTO unspent VALUES(?, ?, ?, ?, ?)', (address, txid, nout, script, satoshis))
         con.commit()
 
+def _unspent_row(address, u):
+    return (address, u['txid'], u['outputIndex'] if 'outputIndex' in u else u['nout'], u['script'], u['satoshis'])
+
+def _put_unspent_rows(cur, rows):
+    cur.executemany('INSERT OR REPLACE INTO unspent VALUES(?, ?, ?, ?, ?)', rows)
+
+def _replace_unspent_rows(cur, addr_utxo_d):
+    cur.executemany('DELETE FROM unspent WHERE address = ?', [(a,) for a in addr_utxo_d])
+    _put_unspent_rows(cur, [_unspent_row(a, u) for a in addr_utxo_d for u in addr_utxo_d[a]])
+
+def put_unspent_many(unspent_l):
+    with db_get_con() as con:
+        _put_unspent_rows(con.cursor(), [_unspent_row(u['address'], u) for u in unspent_l])
+
+def replace_unspent_for_addresses(addr_utxo_d):
+    with db_get_con() as con:
+        _replace_unspent_rows(con.cursor(), addr_utxo_d)
+
 def remove_unspent_db(txid, nout):
     with db_get_con() as con:
         cur = con.cursor()
@@ -149,32 +288,71 @@ def nuke_unspent_db():
         cur.execute('DELETE FROM unspent')
         con.commit()
 
+def get_pubkey_db(account, change, index):
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('SELECT * FROM pubkeys WHERE account = ? AND change = ? AND path_index = ?', (account, change, index))
+        r = pubkey_result(cur.fetchall())
+        return r[0] if len(r) > 0 else None
+
+def put_pubkey_db(account, change, index, public_key, address, uncompressed_address):
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('INSERT OR REPLACE INTO pubkeys VALUES(?, ?, ?, ?, ?, ?)', (account, change, index, public_key, address, uncompressed_address))
+        con.commit()
+
+def get_pubkey_account_db(account):
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('SELECT pubkey FROM pubkey_accounts WHERE account = ?', (account,))
+        r = cur.fetchone()
+        return r[0] if r is not None else None
+
+def reset_pubkey_account_db(account, public_key):
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('DELETE FROM pubkeys WHERE account = ?', (account,))
+        cur.execute('INSERT OR REPLACE INTO pubkey_accounts VALUES(?, ?)', (account, public_key))
+
+def nuke_pubkey_db():
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('DELETE FROM pubkeys')
+        cur.execute('DELETE FROM pubkey_accounts')
+        con.commit()
+
 def rescan(threshold = 1):
-    from lwallet import address, energi
+    from lwallet import address
 
-    nuke_wallet_db()
-    nuke_unspent_db()
+    # record addresses as they are found, so an interrupted rescan keeps them
+    def on_found(ae_l):
+        with db_get_con() as con:
+            con.executemany('INSERT OR IGNORE INTO wallet VALUES(?, ?, ?, ?, ?, ?, ?, ?)', [_address_row(ae) for ae in ae_l])
 
-    addr_d = address.get_address_d(verbose = True)
-    for a in addr_d:
-        if a == 'change':
-            continue
-        ae = addr_d[a]
-        put_address_db(ae['address'], ae['public_key'], energi.hash160(energi.compress_public_key(ae['public_key'])), watchonly = 0,
-          account = ae['account'], index = ae['index'], change = ae['change'])
-        if (len(ae['utxos']) > 0):
-            for u in ae['utxos']:
-                put_unspent_db(ae['address'], u['txid'], u['outputIndex'], u['script'], u['satoshis'])
-    ca = addr_d['change']
-    put_address_db(ca['address'], ca['public_key'], energi.hash160(energi.compress_public_key(ca['public_key'])), watchonly = 0,
-          account = ca['account'], index = ca['index'], change = ca['change'])
+    addr_d = address.get_address_d(threshold = threshold, verbose = True, on_found = on_found)
+
+    # replace everything in a single transaction
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('DELETE FROM wallet')
+        cur.execute('DELETE FROM unspent')
+        _put_address_rows(cur, [_address_row(addr_d[a]) for a in addr_d])
+        _put_unspent_rows(cur, [_unspent_row(addr_d[a]['address'], u) for a in addr_d if a != 'change' for u in addr_d[a]['utxos']])
+        _clear_sync_rows(cur)
 
 def get_address_d(with_change = False):
-    addr_l = get_addresses_db()
-    for ae in addr_l:
-        u = get_unspent(ae['address'])
-        ae['utxos'] = u
-    addr_d = dict([(ae['address'], ae) for ae in addr_l])
+    addr_d = {}
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('SELECT wallet.*, unspent.* FROM wallet LEFT JOIN unspent ON unspent.address = wallet.address ORDER BY wallet.rowid, unspent.rowid')
+        for v in cur:
+            ae = addr_d.get(v[0])
+            if ae is None:
+                ae = wallet_entry(v)
+                ae['utxos'] = []
+                addr_d[v[0]] = ae
+            if v[8] is not None:
+                ae['utxos'].append(unspent_entry(v[8:]))
     if with_change:
         from lwallet import address
 
@@ -187,32 +365,43 @@ def get_address_d(with_change = False):
     return addr_d
 
 def get_balance():
-    addr_d = get_address_d()
-    return sum([u['satoshis'] for k in addr_d for u in addr_d[k]['utxos']])
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('SELECT COALESCE(SUM(unspent.satoshis), 0) FROM unspent JOIN wallet ON wallet.address = unspent.address')
+        return cur.fetchone()[0]
 
 def get_addr_txid(txid, nout):
-    addr_d = get_address_d()
-    for k in addr_d:
-        for u in addr_d[k]['utxos']:
-            if txid == u['txid'] and nout == u['nout']:
-                return addr_d[k]
-    return None
+    with db_get_con() as con:
+        cur = con.cursor()
+        cur.execute('SELECT wallet.* FROM unspent JOIN wallet ON wallet.address = unspent.address WHERE unspent.txid = ? AND unspent.nout = ?', (txid, nout))
+        r = cur.fetchone()
+    if r is None:
+        return None
+    ae = wallet_entry(r)
+    ae['utxos'] = get_unspent(ae['address'])
+    return ae
 
 def _update_address_d(addr_d):
+    al = [addr for addr in addr_d if addr != 'change']
+    if 'change' in addr_d:
+        al.append(addr_d['change']['address'])
+
+    # all the addresses in one go
+    utxo_d = eel.get_unspent_many(al)
+
     max_index = -1
-    k = addr_d.keys()
-    for addr in k:
+    for addr in addr_d:
         if addr != 'change':
-            addr_d[addr]['utxos'] = eel.get_unspent(addr)
+            addr_d[addr]['utxos'] = utxo_d[addr]
             if int(addr_d[addr]['index']) > max_index:
                 max_index = int(addr_d[addr]['index'])
 
     if 'change' in addr_d:
         caddr = addr_d['change']['address']
-        utxos = eel.get_unspent(caddr)
+        utxos = utxo_d[caddr]
         if len(utxos) > 0:
             addr_d['change']['utxos'] = utxos
-            addr_d[addr] = addr_d['change']
+            addr_d[caddr] = addr_d['change']
             addr_d['change'] = address.get_next_change(for_index = max_index)
     else:
         try:
@@ -222,15 +411,158 @@ def _update_address_d(addr_d):
     return addr_d
 
 def updatedb():
+    # the sync point is taken first: the utxos fetched below are at least that recent
+    height, blockhash = _sync_tip()
+
     addr_d = _update_address_d(get_address_d())
-    for addr in addr_d:
-        if addr == 'change':
-            continue
-        if len(get_address_db(addr)) == 0:
-            ae = addr_d[addr]
-            put_address_db(addr, ae['public_key'], energi.hash160(energi.compress_public_key(ae['public_key'])), watchonly = 0, account = ae['account'], index = ae['index'], change = ae['change'])
+    known = set([ae['address'] for ae in get_addresses_db()])
+
+    # one transaction for the whole refresh
+    with db_get_con() as con:
+        cur = con.cursor()
+        _put_address_rows(cur, [_address_row(addr_d[a]) for a in addr_d if a != 'change' and a not in known])
+        _replace_unspent_rows(cur, dict([(a, addr_d[a]['utxos']) for a in addr_d if a != 'change']))
+
+        # and everything is now in sync as of that block
+        _clear_sync_rows(cur)
+        cur.execute('INSERT INTO sync_addresses SELECT address, ? FROM wallet', (height,))
+        cur.execute('INSERT INTO sync_checkpoints VALUES(?, ?)', (height, blockhash))
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+# Incremental sync.  After a full updatedb() each later syncdb() only asks
+# for the address deltas in the blocks since the newest checkpoint and
+# applies them, writing what it changed to a journal.  If that checkpoint
+# is no longer on the best chain (a reorg), the journal is undone back to
+# the newest checkpoint that still is and the sync continues from there;
+# if there is none, it falls back to a full updatedb().  Addresses added
+# to the wallet since (sync_addresses lacks them) get their utxos fetched
+# whole.  Applying a delta twice is harmless, so the node moving on while
+# we sync does not matter.  Mempool transactions are not synced, as with
+# updatedb().
+
+_SYNC_RECEIVE = 0
+_SYNC_SPEND = 1
+
+# how many checkpoints (so how many syncs back a reorg can be undone)
+_sync_checkpoints = 16
+
+def _sync_tip():
+    height = eel.get_blockcount()
+    return height, eel.get_blockhash(height).decode()
+
+def _clear_sync_rows(cur):
+    cur.execute('DELETE FROM sync_checkpoints')
+    cur.execute('DELETE FROM sync_journal')
+    cur.execute('DELETE FROM sync_addresses')
+
+def _sync_point(tip):
+    """
+        Height of the newest checkpoint still on the best chain, or None.
+    """
+    with db_get_con() as con:
+        cpl = con.execute('SELECT height, blockhash FROM sync_checkpoints ORDER BY height DESC').fetchall()
+    for height, blockhash in cpl:
+        if height <= tip and eel.get_blockhash(height).decode() == blockhash:
+            return height
+    return None
+
+def _sync_rollback(cur, height):
+    for op, address, txid, nout, script, satoshis in cur.execute('SELECT op, address, txid, nout, script, satoshis FROM sync_journal WHERE height > ? ORDER BY rowid DESC', (height,)).fetchall():
+        if op == _SYNC_RECEIVE:
+            cur.execute('DELETE FROM unspent WHERE txid = ? AND nout = ?', (txid, nout))
+        else:
+            cur.execute('INSERT OR REPLACE INTO unspent VALUES(?, ?, ?, ?, ?)', (address, txid, nout, script, satoshis))
+    cur.execute('DELETE FROM sync_journal WHERE height > ?', (height,))
+    cur.execute('DELETE FROM sync_checkpoints WHERE height > ?', (height,))
+    cur.execute('DELETE FROM sync_addresses WHERE height > ?', (height,))
+
+def _p2pkh_script(addr):
+    from lwallet import script
+    return b2hs(script.standard_p2pkh_pkh(energi.decode_address(addr)))
+
+def _sync_deltas(al, start, end):
+    """
+        The receives and the spends in blocks start to end, each as
+        (height, (address, txid, nout, script, satoshis)); for a spend
+        that is the output it spent.
+    """
+    from lwallet import Transaction, txcache
+
+    name_d = dict([(a.decode('latin-1') if isinstance(a, bytes) else a, a) for a in al])
+    dl = []
+    for i in range(0, len(al), eel._addresses_per_call):
+        dl += eel.get_address_deltas(al[i:i + eel._addresses_per_call], start, end)
+
+    receives = []
+    spends = []
+    for d in dl:
+        if d['satoshis'] > 0:
+            addr = name_d[d['address']]
+            receives.append((d['height'], (addr, d['txid'], d['index'], _p2pkh_script(addr), d['satoshis'])))
+        elif d['satoshis'] < 0:
+            spends.append(d)
+
+    # a debit names the spending input; the outpoint is in that transaction
+    hex_d = txcache.get_hex_transactions(list(set([d['txid'] for d in spends])))
+    tx_d = {}
+    spent = []
+    for d in spends:
+        tx = tx_d.get(d['txid'])
+        if tx is None:
+            tx = tx_d[d['txid']] = Transaction.CTransaction().deserialize(serialize.ByteReader(hs2b(hex_d[d['txid']])))
+        prevout = tx.vin[d['index']].prevout
+        addr = name_d[d['address']]
+        spent.append((d['height'], (addr, b2hs(prevout.hash[::-1]), prevout.n, _p2pkh_script(addr), -d['satoshis'])))
+
+    return receives, spent
+
+def syncdb(verbose = False):
+    """
+        Brings the unspent table up to date with as little work as the
+        blocks since the last sync allow.
+    """
+    tip, tiphash = _sync_tip()
+
+    height = _sync_point(tip)
+    if height is None:
+        if verbose:
+            print('no usable checkpoint; full update')
+        updatedb()
+        return
+
+    with db_get_con() as con:
+        cur = con.cursor()
+        if cur.execute('SELECT MAX(height) FROM sync_checkpoints').fetchone()[0] != height:
+            if verbose:
+                print('reorg: rolling back to %d' % height)
+            _sync_rollback(cur, height)
+
+        synced = [v[0] for v in cur.execute('SELECT address FROM sync_addresses').fetchall()]
+        fresh = [v[0] for v in cur.execute('SELECT address FROM wallet WHERE address NOT IN (SELECT address FROM sync_addresses)').fetchall()]
+
+    receives, spent = _sync_deltas(synced, height + 1, tip) if height < tip and len(synced) > 0 else ([], [])
+    utxo_d = eel.get_unspent_many(fresh)
+    if verbose:
+        print('synced to %d: %d received, %d spent, %d new addresses' % (tip, len(receives), len(spent), len(fresh)))
 
-        delete_unspent(addr)
-        for u in addr_d[addr]['utxos']:
-            put_unspent_db(addr, u['txid'], u['outputIndex'] if 'outputIndex' in u else u['nout'], u['script'], u['satoshis'])
+    with db_get_con() as con:
+        cur = con.cursor()
 
+        # receives first, so an output received and spent in the range ends
+        # up spent.  Every delta is journaled, even one the table already
+        # reflects (say from an updatedb() newer than its checkpoint), so a
+        # rollback undoes all of them.
+        for h, row in receives:
+            cur.execute('INSERT OR REPLACE INTO unspent VALUES(?, ?, ?, ?, ?)', row)
+        for h, row in spent:
+            cur.execute('DELETE FROM unspent WHERE txid = ? AND nout = ?', row[1:3])
+        cur.executemany('INSERT INTO sync_journal VALUES(?, ?, ?, ?, ?, ?, ?)', [(h, _SYNC_RECEIVE) + row for h, row in receives] + [(h, _SYNC_SPEND) + row for h, row in spent])
+
+        _replace_unspent_rows(cur, utxo_d)
+        cur.executemany('INSERT OR REPLACE INTO sync_addresses VALUES(?, ?)', [(a, tip) for a in fresh])
+        cur.execute('INSERT OR REPLACE INTO sync_checkpoints VALUES(?, ?)', (tip, tiphash))
+
+        # only the newest checkpoints are kept, and the journal back to the oldest of them
+        cur.execute('DELETE FROM sync_checkpoints WHERE height NOT IN (SELECT height FROM sync_checkpoints ORDER BY height DESC LIMIT ?)', (_sync_checkpoints,))
+        cur.execute('DELETE FROM sync_journal WHERE height <= (SELECT MIN(height) FROM sync_checkpoints)')
@@ -5,6 +5,7 @@ import sys
 from lwallet import walletdb
 
 addr_d = walletdb.get_address_d()
+locked = walletdb.get_locked_set()
 
 tot = 0
 for k in addr_d:
@@ -14,6 +15,6 @@ for k in addr_d:
     for u in ae.get('utxos', []):
         tot += u['satoshis']
 
-        print('%s: %s: %f %s' % (path, u['address'], float(u['satoshis']) / 10**8, '(LOCKED)' if walletdb.is_locked_txid(u['txid'], u['nout']) else ''))
+        print('%s: %s: %f %s' % (path, u['address'], float(u['satoshis']) / 10**8, '(LOCKED)' if (u['txid'], u['nout']) in locked else ''))
 
 print('Total: %f' % (float(tot) / 10**8))
@@ -3,9 +3,7 @@
 import sys
 
 from lwallet import Masternode
-
-def b2hs(b):
-    return ''.join(['%2.2x' % c for c in b])
+from lwallet.codec import b2hs
 
 if len(sys.argv) > 1:
     pk, v = Masternode.decode_privkey(sys.argv[1])
@@ -39,14 +39,7 @@ def main():
     print('\nCurrent balance: %f NRG.' % (bal / _NRGSAT))
 
     print('Removing locked outputs.')
-    for a in addr_d:
-        nul = []
-        for u in addr_d[a].get('utxos', []):
-            if not walletdb.is_locked_txid(u['txid'], u['nout']):
-                nul.append(u)
-            else:
-                print('removing locked: %s' % u)
-        addr_d[a]['utxos'] = nul
+    walletdb.remove_locked(addr_d, verbose = True)
 
     sys.stdout.write('Creating transaction; confirm on ledger: '); sys.stdout.flush()
     tx = Transaction.create_tx(to, val, addr_d)
@@ -5,6 +5,7 @@ import sys
 
 from coinapi import eelocal as eel
 from lwallet import address, energi, serialize, walletdb, Transaction
+from lwallet.codec import s2b
 
 _NRGSAT = 10**8
 
@@ -26,9 +27,6 @@ def balance(addr_d):
             s += u.get('satoshis', 0)
     return s
 
-def s2b(s):
-    return bytes([ord(c) for c in s])
-
 def main():
     if len(sys.argv) != 4:
         print('usage: %s <from> <to> <send value sats; negative to send everything>' % basename(sys.argv[0]))
@@ -54,12 +52,7 @@ def main():
     print('\nCurrent balance: %f NRG. (%d Sat)' % (bal / _NRGSAT, bal))
 
     print('Removing locked outputs.')
-    for a in addr_d.keys():
-        nul = []
-        for u in addr_d[a].get('utxos', []):
-            if not walletdb.is_locked_txid(u['txid'], u['nout']):
-                nul.append(u)
-        addr_d[a]['utxos'] = nul
+    walletdb.remove_locked(addr_d)
     bal = balance(addr_d)
     print('\nAvailable balance: %f NRG. (%d Sat)' % (bal / _NRGSAT, bal))
 
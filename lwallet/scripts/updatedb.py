@@ -1,5 +1,11 @@
 #!/usr/bin/env python3.7
 
+import sys
+
 from lwallet import walletdb
 
-walletdb.updatedb()
+# "updatedb.py full" refetches every address's utxos
+if len(sys.argv) > 1 and sys.argv[1] == 'full':
+    walletdb.updatedb()
+else:
+    walletdb.syncdb(verbose = True)
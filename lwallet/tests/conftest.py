@@ -0,0 +1,173 @@
+import base64
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+# The tests run in a scratch home: eelocal reads ~/.coinapi when imported
+# (an [ssh] entry keeps it from looking for a node), and walletdb and
+# txcache write under ~/.energidb.
+_home = tempfile.mkdtemp()
+os.makedirs(os.path.join(_home, '.coinapi'))
+with open(os.path.join(_home, '.coinapi', 'apikey.config'), 'w') as f:
+    f.write('[ssh]\nhost = localhost\n')
+os.environ['HOME'] = _home
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lwallet import emulator as emu
+from lwallet import ledger
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+@pytest.fixture
+def walletdb(tmp_path, monkeypatch):
+    from lwallet import walletdb
+
+    walletdb.db_close()
+    monkeypatch.setattr(walletdb, '_db_dir', str(tmp_path))
+    yield walletdb
+    walletdb.db_close()
+
+@pytest.fixture
+def emulator(monkeypatch):
+    """
+        The ledger is the software emulator; the fixture is the seed setter.
+    """
+    from lwallet import address, ledger
+
+    def set_seed(seed = None):
+        if seed is None:
+            monkeypatch.delenv('LWALLET_EMULATOR_SEED', raising = False)
+        else:
+            monkeypatch.setenv('LWALLET_EMULATOR_SEED', seed.hex())
+        ledger.close()
+
+    monkeypatch.setenv('LWALLET_EMULATOR', '1')
+    monkeypatch.delenv('LWALLET_LOCAL_DERIVATION', raising = False)
+    set_seed()
+    yield set_seed
+    ledger.close()
+    address._xpub_d.clear()
+    address._pubkey_checked_d.clear()
+
+class FlakyEmulator(emu.Emulator):
+    """
+        Loses the connection right after the device got the next APDU with
+        instruction fail_ins.
+    """
+    fail_ins = None
+
+    def exchange(self, apdu, timeout = 20000):
+        if apdu[1] != FlakyEmulator.fail_ins:
+            return super().exchange(apdu, timeout)
+
+        FlakyEmulator.fail_ins = None
+        try:
+            super().exchange(apdu, timeout)
+        except ledger.CommException:
+            pass
+        raise OSError('device went away')
+
+@pytest.fixture
+def flaky(emulator, monkeypatch):
+    """
+        The emulator, losing the connection once after the instruction
+        assigned to flaky.fail_ins.
+    """
+    monkeypatch.setattr(ledger, '_open', lambda: FlakyEmulator(emu.from_env().seed))
+    ledger.close()
+    yield FlakyEmulator
+    FlakyEmulator.fail_ins = None
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+        A small energid: answers JSON-RPC (single or batch, the latter in
+        reverse order) and remembers which client port each request came
+        from.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _result(self, req):
+        m = req['method']
+        if m == 'sleep':
+            time.sleep(req['params'][0])
+        if m in ('getblockcount', 'sleep'):
+            return {'result': 12, 'error': None, 'id': req['id']}
+        if m == 'getblockhash':
+            return {'result': '%064x' % req['params'][0], 'error': None, 'id': req['id']}
+        if m == 'getaddressutxos':
+            return {'result': [{'address': a, 'satoshis': 1} for a in req['params'][0]['addresses']], 'error': None, 'id': req['id']}
+        if m == 'getrawtransaction' and req['params'][0] in self.server.txs:
+            return {'result': self.server.txs[req['params'][0]], 'error': None, 'id': req['id']}
+        return {'result': None, 'error': {'code': -5, 'message': 'No such transaction'}, 'id': req['id']}
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.ports.append(self.client_address[1])
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        try:
+            self._post()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _post(self):
+        if self.headers['Authorization'] != 'Basic ' + base64.b64encode(b'user:pass').decode():
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if isinstance(req, list):
+            self.server.batches.append(len(req))
+            r = [self._result(q) for q in reversed(req)]
+        else:
+            r = self._result(req)
+
+        body = json.dumps(r).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        # like energid dropping an idle connection, without a word
+        if self.server.hang_up:
+            self.close_connection = True
+
+@pytest.fixture
+def energid(monkeypatch):
+    """
+        eelocal talking JSON-RPC to a Handler server.
+    """
+    from coinapi import eelocal as eel
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.ports = []
+    server.batches = []
+    server.lock = threading.Lock()
+    server.active = 0
+    server.peak = 0
+    server.hang_up = False
+    server.txs = dict([('%064x' % i, '%02x' % i * 10) for i in range(250)])
+    threading.Thread(target = server.serve_forever, args = (0.05,), daemon = True).start()
+
+    eel._rpc_close()
+    monkeypatch.setattr(eel, '_rpc_host', '127.0.0.1')
+    monkeypatch.setattr(eel, '_rpc_port', server.server_address[1])
+    monkeypatch.setattr(eel, '_rpc_auth', 'user:pass')
+    monkeypatch.setattr(eel, 'do_cli', eel._do_cli_rpc)
+    yield server
+    eel._rpc_close()
+    server.shutdown()
+    server.server_close()
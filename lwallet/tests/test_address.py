@@ -0,0 +1,79 @@
+import sqlite3
+import threading
+
+import pytest
+
+from lwallet import address, energi, ledger
+
+
+def device_address(account = 0, change = 0, index = 0):
+    keypath = energi.serialize_pathd(energi.create_pathd(account = account, change = change, index = index))
+    return energi.encode_address(energi.compress_public_key(ledger.get_public_key(keypath)))
+
+def test_derive_caches_public_keys(walletdb, emulator):
+    a = address.derive(0, 0, 3)[1]
+    count = ledger.get_dongle().apdu_count
+    assert address.derive(0, 0, 3)[1] == a == device_address(index = 3)
+    assert ledger.get_dongle().apdu_count == count + 1
+
+def test_pubkey_cache_follows_device(walletdb, emulator):
+    a = address.derive(0, 0, 0)[1]
+
+    # another device (or a restore from another seed)
+    emulator(bytes(range(32)))
+    b = address.derive(0, 0, 0)[1]
+    assert b != a
+    assert b == device_address()
+
+    # and its keys are the ones cached now
+    assert walletdb.get_pubkey_db(0, 0, 0)['address'] == b
+
+def test_second_rescan_asks_the_device_nothing(walletdb, emulator, monkeypatch):
+    monkeypatch.setenv('LWALLET_LOCAL_DERIVATION', '1')
+    used = set([device_address(change = c, index = i).decode() for c, i in ((0, 0), (1, 0), (0, 1))])
+    monkeypatch.setattr(address.eel, 'get_used_addresses', lambda al: set([a for a in al if a in used]))
+    monkeypatch.setattr(address.eel, 'get_unspent_many', lambda al: dict([(a, []) for a in al]))
+    monkeypatch.setattr(address.eel, 'get_address_txids', lambda a: ['00' * 32] if a in used else [])
+
+    walletdb.rescan()
+    found = sorted([ae['address'] for ae in walletdb.get_addresses_db()])
+
+    calls = []
+    for name in ('get_public_key', 'get_public_key_chaincode'):
+        monkeypatch.setattr(ledger, name, lambda *args, name = name: calls.append(name))
+    walletdb.rescan()
+    assert sorted([ae['address'] for ae in walletdb.get_addresses_db()]) == found
+    assert calls == []
+
+def test_local_derivation_matches_device(walletdb, emulator, monkeypatch):
+    monkeypatch.setenv('LWALLET_LOCAL_DERIVATION', '1')
+    for change, index in ((0, 0), (0, 7), (2, 7)):
+        assert address.derive(0, change, index)[1] == device_address(change = change, index = index)
+
+def test_discovery_closes_worker_connections(walletdb, emulator, monkeypatch):
+    # used: index 0 and 2 with change 1, index 3
+    used = set([device_address(change = c, index = i).decode() for c, i in ((0, 0), (1, 0), (0, 2), (1, 2), (0, 3))])
+    monkeypatch.setattr(address.eel, 'get_used_addresses', lambda al: set([a for a in al if a in used]))
+
+    opened = []
+    class Connection(sqlite3.Connection):
+        closed = False
+        def close(self):
+            self.closed = True
+            super().close()
+
+    connect = walletdb.lite.connect
+    def tracked(*args, **kw):
+        con = connect(*args, factory = Connection, **kw)
+        opened.append((threading.get_ident(), con))
+        return con
+    monkeypatch.setattr(walletdb.lite, 'connect', tracked)
+
+    found = address.get_all_used_addresses(threshold = 2, workers = 2)
+    assert [(ae['index'], ae['change']) for ae in found] == [(0, 0), (0, 1), (2, 0), (2, 1), (3, 0)]
+
+    # the pool threads closed theirs
+    me = threading.get_ident()
+    workers = [con for ident, con in opened if ident != me]
+    assert len(workers) > 0
+    assert all([con.closed for con in workers])
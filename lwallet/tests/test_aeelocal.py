@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from coinapi import aeelocal as aeel
+
+
+@pytest.fixture
+def writers(energid, monkeypatch):
+    """
+        Every connection aeelocal opens, starting from a fresh pool.
+    """
+    monkeypatch.setattr(aeel, '_loop', None)
+    monkeypatch.setattr(aeel, '_sem', None)
+    monkeypatch.setattr(aeel, '_pool', [])
+
+    wl = []
+    open_connection = asyncio.open_connection
+    async def recording_open_connection(*args, **kwargs):
+        con = await open_connection(*args, **kwargs)
+        wl.append(con[1])
+        return con
+    monkeypatch.setattr(asyncio, 'open_connection', recording_open_connection)
+    return wl
+
+
+def test_gather(energid, writers):
+    async def run():
+        return await asyncio.gather(*[aeel._rpc('sleep', [0.02]) for _ in range(40)])
+    assert asyncio.run(run()) == [12] * 40
+    assert energid.peak <= aeel._max_connections
+    assert len(writers) <= aeel._max_connections
+
+def test_pool_closed_when_loop_ends(energid, writers):
+    for _ in range(2):
+        assert asyncio.run(aeel.get_blockcount()) == 12
+        assert len(writers) > 0
+        assert all([w.is_closing() for w in writers])
+
+def test_timeout_not_resent(energid, writers, monkeypatch):
+    monkeypatch.setattr(aeel, '_timeout', 0.1)
+    async def run():
+        await aeel.get_blockcount()
+        try:
+            await aeel._rpc('sleep', [0.3])
+        finally:
+            assert len(aeel._pool) == 0
+            assert all([w.is_closing() for w in writers])
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+    # the pooled connection timed out and nothing was sent again
+    assert len(writers) == 1
+    assert len(energid.ports) == 2
+
+def test_stale_connection_resent(energid, writers):
+    energid.hang_up = True
+    async def run():
+        for _ in range(3):
+            assert await aeel.get_blockcount() == 12
+    asyncio.run(run())
+    assert len(writers) == 3
+    assert len(energid.ports) == 3
+
+def test_cancel(energid, writers):
+    async def run():
+        task = asyncio.ensure_future(aeel._rpc('sleep', [0.3]))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert len(aeel._pool) == 0
+        assert len(writers) == 1
+        assert writers[0].is_closing()
+        # the next call gets a new connection
+        assert await aeel.get_blockcount() == 12
+        assert len(writers) == 2
+    asyncio.run(run())
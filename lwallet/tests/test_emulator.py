@@ -0,0 +1,33 @@
+import pytest
+
+from lwallet import emulator as emu
+from lwallet import energi, ledger, serialize
+
+
+def status(e, apdu):
+    with pytest.raises(ledger.CommException) as ei:
+        e.exchange(apdu)
+    return ei.value.sw
+
+@pytest.mark.parametrize('p1, p2', [(0x01, 0x00), (0x00, 0x01), (0x80, 0x80)])
+def test_hash_sign_checks_p1_p2(p1, p2):
+    keypath = serialize.hs2b(energi.serialize_pathd(energi.create_pathd()))
+    data = keypath + b'\x00' + b'\x00' * 4 + b'\x01'
+    assert status(emu.Emulator(), ledger.apdu(ledger.INS_HASH_SIGN, p1, p2, data)) == emu.SW_INCORRECT_P1_P2
+
+def test_hash_sign_needs_a_transaction():
+    keypath = serialize.hs2b(energi.serialize_pathd(energi.create_pathd()))
+    data = keypath + b'\x00' + b'\x00' * 4 + b'\x01'
+    assert status(emu.Emulator(), ledger.apdu(ledger.INS_HASH_SIGN, 0x00, 0x00, data)) == emu.SW_CONDITIONS_OF_USE_NOT_SATISFIED
+
+def test_tampered_trusted_input_is_rejected():
+    e = emu.Emulator()
+    tib = bytes([emu.MAGIC_TRUSTED_INPUT]) + b'\x00' * 55
+    data = b'\x01\x00\x00\x00\x01' + bytes([0x01, len(tib)]) + tib + b'\x00' + b'\xff' * 4
+    assert status(e, ledger.apdu(ledger.INS_HASH_INPUT_START, 0x00, 0x00, data)) != emu.SW_OK
+
+def test_seed_gives_keys():
+    keypath = serialize.hs2b(energi.serialize_pathd(energi.create_pathd()))
+    a = emu.Emulator().exchange(ledger.apdu(ledger.INS_GET_WALLET_PUBLIC_KEY, 0, 0, keypath))
+    b = emu.Emulator(bytes(32)).exchange(ledger.apdu(ledger.INS_GET_WALLET_PUBLIC_KEY, 0, 0, keypath))
+    assert ledger.parse_get_wallet_public_key_response(a) != ledger.parse_get_wallet_public_key_response(b)
@@ -0,0 +1,25 @@
+import pytest
+
+from lwallet import energi, ledger
+
+
+def test_stateless_apdu_is_resent(flaky):
+    keypath = energi.serialize_pathd(energi.create_pathd())
+    expected = ledger.get_public_key(keypath)
+    session = ledger.get_session_id()
+
+    flaky.fail_ins = ledger.INS_GET_WALLET_PUBLIC_KEY
+    assert ledger.get_public_key(keypath) == expected
+    assert ledger.get_session_id() == session + 1
+
+def test_stateful_apdu_is_not_resent(flaky):
+    keypath = energi.serialize_pathd(energi.create_pathd())
+    dongle = ledger.get_dongle()
+
+    flaky.fail_ins = ledger.INS_HASH_INPUT_FINALIZE_FULL
+    with pytest.raises(ledger.TransportError):
+        ledger.call_hash_input_finalize_full_change(keypath)
+
+    # sent once, and the session is gone
+    assert dongle.apdu_count == 1
+    assert ledger.get_dongle() is not dongle
@@ -0,0 +1,63 @@
+import pytest
+
+from coinapi import eelocal as eel
+
+
+def test_cli_output(energid):
+    assert eel.get_blockcount() == 12
+    assert eel.get_blockhash(11) == ('%064x' % 11).encode()
+    assert eel.get_unspent_many([b'A', 'B']) == {b'A': [{'address': 'A', 'satoshis': 1}], 'B': [{'address': 'B', 'satoshis': 1}]}
+
+def test_keep_alive(energid):
+    for _ in range(5):
+        eel.get_blockcount()
+    assert len(energid.ports) == 5
+    assert len(set(energid.ports)) == 1
+
+def test_reconnects_after_close(energid):
+    energid.hang_up = True
+    for _ in range(3):
+        assert eel.get_blockcount() == 12
+    assert len(set(energid.ports)) == 3
+
+def test_timeout_not_resent(energid, monkeypatch):
+    monkeypatch.setattr(eel, '_rpc_timeout', 0.1)
+    eel.get_blockcount()
+    with pytest.raises(OSError):
+        eel._rpc('sleep', [0.3])
+    assert len(energid.ports) == 2
+    assert eel._rpc_local.con is None
+
+def test_new_connection_not_resent(energid, monkeypatch):
+    # a fresh connection failing is not a stale one
+    calls = []
+    def connect(self):
+        calls.append(self)
+        raise ConnectionResetError('reset')
+    monkeypatch.setattr(eel.http.client.HTTPConnection, 'connect', connect)
+    with pytest.raises(ConnectionResetError):
+        eel.get_blockcount()
+    assert len(calls) == 1
+
+def test_error(energid):
+    with pytest.raises(RuntimeError, match = 'No such transaction'):
+        eel.get_hex_transaction('ff' * 32)
+
+def test_authorization(energid, monkeypatch):
+    monkeypatch.setattr(eel, '_rpc_auth', 'user:wrong')
+    with pytest.raises(RuntimeError, match = 'authorization'):
+        eel.get_blockcount()
+
+def test_batch(energid):
+    txid_l = list(energid.txs)
+    assert eel.get_hex_transactions(txid_l) == energid.txs
+    assert energid.batches == [100, 100, 50]
+    assert len(set(energid.ports)) == 1
+
+def test_batch_ids(energid):
+    # answers come back in reverse; results follow the calls
+    assert eel._rpc_batch([('getblockhash', [i]) for i in range(5)]) == ['%064x' % i for i in range(5)]
+
+def test_batch_error(energid):
+    with pytest.raises(RuntimeError, match = 'getrawtransaction: No such transaction'):
+        eel._rpc_batch([('getrawtransaction', ['%064x' % 1, False]), ('getrawtransaction', ['ff' * 32, False])])
@@ -0,0 +1,26 @@
+from lwallet import serialize, Transaction
+
+
+class PaymentMap:
+    def deserialize(self, m):
+        self.block_hash = serialize.deser_uint256(m)
+        self.d = serialize.deser_map_uint256_int(m)
+        return self
+
+def test_from_hex_gives_bytes():
+    hs = serialize.b2hs(b'\x11' * 32 + serialize.ser_map_uint256_int({b'\x22' * 32: 5, b'\x33' * 32: -1}))
+    o = serialize.from_hex(PaymentMap(), hs)
+    assert isinstance(o.block_hash, bytes)
+    assert o.d == {b'\x22' * 32: 5, b'\x33' * 32: -1}
+
+def test_transaction_round_trip():
+    tx = Transaction.CTransaction()
+    tx.vin.append(Transaction.CTxIn(Transaction.COutPoint(b'\x01' * 32, 3), b'\x51\x52', 0xfffffffe))
+    tx.vout.append(Transaction.CTxOut(12345, b'\x76\xa9'))
+    tx.nLockTime = 99
+    raw = tx.serialize()
+
+    tx2 = Transaction.CTransaction().deserialize(serialize.ByteReader(raw))
+    assert tx2.serialize() == raw
+    assert isinstance(tx2.vin[0].scriptSig, bytes)
+    assert serialize.from_hex(Transaction.CTransaction(), serialize.b2hs(raw)).serialize() == raw
@@ -0,0 +1,127 @@
+import copy
+import random
+import struct
+
+import pytest
+
+from lwallet import script, serialize, Transaction
+from lwallet.Transaction import CTransaction, CTxIn, CTxOut, COutPoint
+
+HASHTYPES = [0x01, 0x02, 0x03, 0x81, 0x82, 0x83]
+
+# The signature hash as it was computed before SignatureHasher: a deep copy
+# of the transaction, edited and serialized whole for every input.  It
+# serializes by hand so it does not depend on the cached serialize().
+
+def _ser_tx(tx):
+    r = struct.pack('<i', tx.nVersion) + serialize.ser_compact_size(len(tx.vin))
+    for v in tx.vin:
+        r += bytes(v.prevout.hash) + struct.pack('<I', v.prevout.n) + serialize.ser_string(bytes(v.scriptSig)) + struct.pack('<I', v.nSequence)
+    r += serialize.ser_compact_size(len(tx.vout))
+    for v in tx.vout:
+        r += struct.pack('<q', v.nValue) + serialize.ser_string(bytes(v.scriptPubKey))
+    return r + struct.pack('<I', tx.nLockTime)
+
+def reference_signature_hash(script_code, txto, inIdx, hashtype):
+    if inIdx >= len(txto.vin):
+        raise RuntimeError('input index out of range (%d >= %d)' % (inIdx, len(txto.vin)))
+
+    txtmp = copy.deepcopy(txto)
+
+    for i in range(len(txtmp.vin)):
+        if i != inIdx:
+            txtmp.vin[i].scriptSig = b''
+    txtmp.vin[inIdx].scriptSig = script.remove(script_code, [script.get_opcode('OP_CODESEPARATOR')])
+
+    if (hashtype & 0x1f) == 0x02:
+        txtmp.vout = []
+        for i in range(len(txtmp.vin)):
+            if i != inIdx:
+                txtmp.vin[i].nSequence = 0
+
+    elif (hashtype & 0x1f) == 0x03:
+        outIdx = inIdx
+        if outIdx >= len(txtmp.vout):
+            raise RuntimeError('output index out of range (%d >= %d)' % (outIdx, len(txtmp.vout)))
+
+        tmp = txtmp.vout[outIdx]
+        txtmp.vout = []
+        for i in range(outIdx):
+            txtmp.vout.append(CTxOut(-1))
+        txtmp.vout.append(tmp)
+
+        for i in range(len(txtmp.vin)):
+            if i != inIdx:
+                txtmp.vin[i].nSequence = 0
+
+    if hashtype & 0x80:
+        txtmp.vin = [txtmp.vin[inIdx]]
+
+    return Transaction.hash256(_ser_tx(txtmp) + struct.pack('<I', hashtype))
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+def _random_script(r):
+    # P2PKH, sometimes with an OP_CODESEPARATOR to be removed
+    s = script.standard_p2pkh_pkh(bytes(r.randrange(256) for _ in range(20)))
+    if r.random() < 0.3:
+        i = r.choice([0, 1, 2, 23, 24, 25]) # between opcodes
+        s = s[:i] + bytes([script.get_opcode('OP_CODESEPARATOR')]) + s[i:]
+    return s
+
+def random_tx(r):
+    tx = CTransaction()
+    tx.nVersion = r.choice([1, 2, 3])
+    for _ in range(r.randrange(1, 7)):
+        tx.vin.append(CTxIn(COutPoint(bytes(r.randrange(256) for _ in range(32)), r.randrange(4)),
+                            bytes(r.randrange(256) for _ in range(r.randrange(0, 110))),
+                            r.choice([0xffffffff, 0xfffffffe, r.randrange(2**32)])))
+    for _ in range(r.randrange(0, 6)):
+        tx.vout.append(CTxOut(r.randrange(10**12), _random_script(r)))
+    tx.nLockTime = r.choice([0, r.randrange(2**32)])
+    return tx
+
+@pytest.mark.parametrize('seed', range(40))
+def test_matches_reference(seed):
+    r = random.Random(seed)
+    tx = random_tx(r)
+    raw = tx.serialize()
+    hasher = Transaction.SignatureHasher(tx)
+
+    for inIdx in range(len(tx.vin)):
+        script_code = _random_script(r)
+        for hashtype in HASHTYPES:
+            try:
+                expected = reference_signature_hash(script_code, tx, inIdx, hashtype)
+            except RuntimeError:
+                # SIGHASH_SINGLE with no matching output
+                assert hashtype & 0x1f == 0x03 and inIdx >= len(tx.vout)
+                with pytest.raises(RuntimeError):
+                    hasher.hash(script_code, inIdx, hashtype)
+                with pytest.raises(RuntimeError):
+                    Transaction.signature_hash(script_code, tx, inIdx, hashtype)
+                continue
+
+            assert hasher.hash(script_code, inIdx, hashtype) == expected
+            assert Transaction.signature_hash(script_code, tx, inIdx, hashtype) == expected
+
+    # hashing must not have touched the transaction
+    assert tx.serialize() == raw
+
+def test_single_out_of_range():
+    tx = CTransaction()
+    tx.vin = [CTxIn(COutPoint(b'\x01' * 32, 0)), CTxIn(COutPoint(b'\x02' * 32, 1))]
+    tx.vout = [CTxOut(1000, b'\x51')]
+    code = b'\x51'
+
+    for hashtype in (0x03, 0x83):
+        assert Transaction.signature_hash(code, tx, 0, hashtype) == reference_signature_hash(code, tx, 0, hashtype)
+        with pytest.raises(RuntimeError):
+            reference_signature_hash(code, tx, 1, hashtype)
+        with pytest.raises(RuntimeError):
+            Transaction.signature_hash(code, tx, 1, hashtype)
+
+def test_input_out_of_range():
+    tx = random_tx(random.Random(1))
+    with pytest.raises(RuntimeError):
+        Transaction.signature_hash(b'', tx, len(tx.vin), 0x01)
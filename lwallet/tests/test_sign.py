@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from coinapi import eelocal as eel
+from lwallet import address, energi, ledger, script, serialize, txcache, Transaction
+from lwallet.Transaction import CTransaction, CTxIn, CTxOut, COutPoint
+
+
+def _random_bytes(r, n):
+    return bytes(r.randrange(256) for _ in range(n))
+
+def previous_tx(r, nin, pay_to, value):
+    tx = CTransaction()
+    for _ in range(nin):
+        tx.vin.append(CTxIn(COutPoint(_random_bytes(r, 32), r.randrange(4)), _random_bytes(r, r.randrange(100, 110)), 0xffffffff))
+    tx.vout.append(CTxOut(r.randrange(10**8), script.standard_p2pkh_pkh(_random_bytes(r, 20))))
+    tx.vout.append(CTxOut(value, script.standard_p2pkh_pkh(energi.decode_address(pay_to))))
+    tx.nLockTime = r.randrange(2**32)
+    return tx
+
+@pytest.fixture
+def wallet(walletdb, emulator, tmp_path, monkeypatch):
+    """
+        Three emulator addresses, each paid by a previous transaction that
+        the "node" (eelocal) can return.
+    """
+    monkeypatch.setattr(txcache, '_cache_dir', str(tmp_path / 'txcache'))
+    txcache.clear()
+    Transaction.clear_trusted_inputs()
+
+    r = random.Random(7)
+    address_d = {}
+    prev_d = {}
+    for i, nin in enumerate((1, 40, 150)):
+        public_key, a, _ = address.derive(0, 0, i)
+        ae = energi.create_pathd(index = i)
+        ae['public_key'] = public_key
+        address_d[a] = ae
+
+        p = previous_tx(r, nin, a, 100000 * (i + 1))
+        raw = p.serialize()
+        prev_d[serialize.b2hs(Transaction.hash256(raw)[::-1])] = serialize.b2hs(raw)
+
+    monkeypatch.setattr(eel, 'get_hex_transaction', lambda txid: prev_d[txid])
+    monkeypatch.setattr(eel, 'get_hex_transactions', lambda txid_l: dict([(txid, prev_d[txid]) for txid in txid_l]))
+    yield address_d, prev_d
+    txcache.clear()
+    Transaction.clear_trusted_inputs()
+
+def spend(prev_d):
+    tx = CTransaction()
+    tx.vin = [CTxIn(COutPoint(serialize.hs2b(txid), 1), b'', 0xffffffff) for txid in prev_d]
+    tx.vout = [CTxOut(5000 * k, script.standard_p2pkh_pkh(bytes([k]) * 20)) for k in range(1, 9)]
+    return tx
+
+def test_sign_and_verify(wallet):
+    address_d, prev_d = wallet
+    signed = Transaction.sign_tx(spend(prev_d), address_d)
+
+    prevout_d = dict([(txid, {'hex': prev_d[txid]}) for txid in prev_d])
+    assert Transaction.verify_tx_inputs(signed, prevout_d) == [True] * len(prev_d)
+    assert Transaction.verify_tx(signed, prevout_d)
+
+    # a changed output breaks every signature
+    signed.vout[0].nValue += 1
+    assert not any(Transaction.verify_tx_inputs(signed, prevout_d))
+
+def test_trusted_input_apdu_count(wallet):
+    address_d, prev_d = wallet
+    dongle = ledger.get_dongle()
+
+    for hs in prev_d.values():
+        tx = CTransaction().deserialize(serialize.ByteReader(serialize.hs2b(hs)))
+
+        count = dongle.apdu_count
+        tib = Transaction.get_trusted_input(tx, 1)
+        packed = dongle.apdu_count - count
+
+        # one APDU per field, as before: version, each input, each output and locktime
+        per_field = len(tx.vin) + len(tx.vout) + 2
+        assert packed == len(Transaction.pack_trusted_input(tx))
+        assert packed < per_field
+        assert tib[0] == 0x32
+
+def test_retry_reuses_trusted_inputs(wallet):
+    address_d, prev_d = wallet
+    dongle = ledger.get_dongle()
+    tx = spend(prev_d)
+
+    count = dongle.apdu_count
+    Transaction.sign_tx(tx, address_d)
+    first = dongle.apdu_count - count
+
+    count = dongle.apdu_count
+    Transaction.sign_tx(tx, address_d)
+    assert dongle.apdu_count - count < first
+
+def test_sign_starts_over_after_lost_connection(wallet, flaky):
+    address_d, prev_d = wallet
+
+    # the device got a HASH SIGN, but the answer was lost
+    flaky.fail_ins = ledger.INS_HASH_SIGN
+    signed = Transaction.sign_tx(spend(prev_d), address_d)
+
+    prevout_d = dict([(txid, {'hex': prev_d[txid]}) for txid in prev_d])
+    assert flaky.fail_ins is None
+    assert Transaction.verify_tx(signed, prevout_d)
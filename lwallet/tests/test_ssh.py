@@ -0,0 +1,85 @@
+import os
+import subprocess
+
+import pytest
+
+from coinapi import eelocal as eel
+
+
+@pytest.fixture
+def ssh(tmp_path, monkeypatch):
+    """
+        eelocal running energi-cli over ssh, with the ssh commands it would
+        run recorded instead.  A master started with a ControlPath in an
+        existing directory creates the socket, as ssh does.
+    """
+    runs = {'master': [], 'cli': [], 'stop': []}
+
+    def check_call(argv, **kw):
+        runs['master'].append(argv)
+        path = [a.split('=', 1)[1] for a in argv if a.startswith('ControlPath=')][0]
+        if not os.path.isdir(os.path.dirname(path)):
+            raise subprocess.CalledProcessError(255, argv)
+        open(path, 'w').close()
+
+    def check_output(argv, **kw):
+        runs['cli'].append(argv)
+        return b'12\n'
+
+    monkeypatch.setattr(subprocess, 'check_call', check_call)
+    monkeypatch.setattr(subprocess, 'check_output', check_output)
+    monkeypatch.setattr(subprocess, 'call', lambda argv, **kw: runs['stop'].append(argv))
+    monkeypatch.setattr(eel.atexit, 'register', lambda f: None)
+
+    monkeypatch.setattr(eel, 'do_cli', eel._do_cli_remote)
+    monkeypatch.setattr(eel, '_keyfile', '/keys/id')
+    monkeypatch.setattr(eel, '_user', 'energi')
+    monkeypatch.setattr(eel, '_host', 'node')
+    monkeypatch.setattr(eel, '_ssh_multiplex', True)
+    monkeypatch.setattr(eel, '_ssh_control', str(tmp_path / 'ssh-control'))
+    monkeypatch.setattr(eel, '_ssh_master', False)
+    monkeypatch.setattr(eel, '_ssh_master_failed', False)
+    monkeypatch.setattr(eel, '_ssh_stats', {'calls': 0, 'reused': 0, 'connects': 0, 'masters': 0})
+    return runs
+
+
+def test_command_lines(ssh):
+    control = 'ControlPath=%s' % eel._ssh_control
+    for _ in range(3):
+        assert eel.get_blockcount() == 12
+
+    assert ssh['master'] == [['ssh', '-i', '/keys/id', '-M', '-N', '-f', '-o', control, '-o', 'ControlPersist=600', 'energi@node']]
+    assert ssh['cli'] == [['ssh', '-i', '/keys/id', '-o', 'ControlMaster=no', '-o', control, 'energi@node', 'energi-cli getblockcount', '2>&1']] * 3
+    assert eel.get_ssh_stats() == {'calls': 3, 'reused': 3, 'connects': 0, 'masters': 1}
+
+    eel._ssh_stop_master()
+    assert ssh['stop'] == [['ssh', '-i', '/keys/id', '-o', control, '-O', 'exit', 'energi@node']]
+
+def test_no_keyfile_or_user(ssh, monkeypatch):
+    monkeypatch.setattr(eel, '_keyfile', None)
+    monkeypatch.setattr(eel, '_user', None)
+    eel.get_blockcount()
+    assert ssh['master'][0][:4] == ['ssh', '-M', '-N', '-f']
+    assert ssh['master'][0][-1] == 'node'
+    assert ssh['cli'][0][:3] == ['ssh', '-o', 'ControlMaster=no']
+    assert ssh['cli'][0][-3:] == ['node', 'energi-cli getblockcount', '2>&1']
+
+def test_missing_control_directory(ssh, tmp_path, monkeypatch):
+    monkeypatch.setattr(eel, '_ssh_control', str(tmp_path / 'missing' / 'ssh-control'))
+    for _ in range(2):
+        assert eel.get_blockcount() == 12
+
+    # the master is tried once; every call then connects on its own
+    assert len(ssh['master']) == 1
+    assert len(ssh['cli']) == 2
+    assert eel.get_ssh_stats() == {'calls': 2, 'reused': 0, 'connects': 2, 'masters': 0}
+
+    eel._ssh_stop_master()
+    assert ssh['stop'] == []
+
+def test_multiplex_off(ssh, monkeypatch):
+    monkeypatch.setattr(eel, '_ssh_multiplex', False)
+    eel.get_blockcount()
+    assert ssh['master'] == []
+    assert ssh['cli'] == [['ssh', '-i', '/keys/id', 'energi@node', 'energi-cli getblockcount', '2>&1']]
+    assert eel.get_ssh_stats()['connects'] == 1
@@ -0,0 +1,233 @@
+import random
+
+import pytest
+
+from coinapi import eelocal as eel
+from lwallet import address, energi, script, serialize, txcache, Transaction
+from lwallet.Transaction import CTransaction, CTxIn, CTxOut, COutPoint
+
+
+class Chain:
+    """
+        A node for eelocal: blocks of address deltas, and the transactions
+        behind them.
+    """
+    def __init__(self):
+        self.r = random.Random(3)
+        self.blocks = []
+        self.pending = []
+        self.tx_d = {}
+        self.lag = 0
+        self.delta_calls = []
+        self.mine()
+
+    def _tx(self, vin, vout):
+        tx = CTransaction()
+        tx.vin = vin
+        tx.vout = vout
+        raw = tx.serialize()
+        txid = serialize.b2hs(Transaction.hash256(raw)[::-1])
+        self.tx_d[txid] = serialize.b2hs(raw)
+        return txid
+
+    def _outpoint(self):
+        return COutPoint(bytes(self.r.randrange(256) for _ in range(32)), 0)
+
+    def pay(self, a, satoshis):
+        txid = self._tx([CTxIn(self._outpoint(), b'', 0xffffffff)], [CTxOut(satoshis, script.standard_p2pkh_pkh(energi.decode_address(a)))])
+        self.pending.append({'address': a, 'txid': txid, 'index': 0, 'satoshis': satoshis})
+        return txid, 0
+
+    def spend(self, a, outpoint, satoshis):
+        txid = self._tx([CTxIn(COutPoint(serialize.hs2b(outpoint[0]), outpoint[1]), b'', 0xffffffff)], [CTxOut(satoshis, b'')])
+        self.pending.append({'address': a, 'txid': txid, 'index': 0, 'satoshis': -satoshis})
+        return txid
+
+    def mine(self):
+        height = len(self.blocks)
+        blockhash = '%064x' % self.r.randrange(2**256)
+        self.blocks.append((blockhash, [dict(d, height = height) for d in self.pending]))
+        self.pending = []
+
+    def reorg(self, height):
+        del self.blocks[height + 1:]
+
+    def deltas(self):
+        return [d for blockhash, dl in self.blocks for d in dl]
+
+    def get_blockcount(self):
+        return len(self.blocks) - 1 - self.lag
+
+    def get_blockhash(self, height):
+        return self.blocks[height][0].encode()
+
+    def get_address_deltas(self, al, start, end):
+        al = [serialize.b2s(a) if isinstance(a, bytes) else a for a in al]
+        self.delta_calls.append((set(al), start, end))
+        return [d for d in self.deltas() if d['address'] in al and start <= d['height'] <= end]
+
+    def get_unspent_many(self, al):
+        spent = set()
+        for d in self.deltas():
+            if d['satoshis'] < 0:
+                tx = CTransaction().deserialize(serialize.ByteReader(serialize.hs2b(self.tx_d[d['txid']])))
+                spent.add((serialize.b2hs(tx.vin[0].prevout.hash[::-1]), tx.vin[0].prevout.n))
+
+        rd = dict([(a, []) for a in al])
+        for a in al:
+            s = serialize.b2s(a) if isinstance(a, bytes) else a
+            for d in self.deltas():
+                if d['address'] == s and d['satoshis'] > 0 and (d['txid'], d['index']) not in spent:
+                    rd[a].append({'address': s, 'txid': d['txid'], 'outputIndex': d['index'], 'satoshis': d['satoshis'],
+                                  'script': serialize.b2hs(script.standard_p2pkh_pkh(energi.decode_address(s))), 'height': d['height']})
+        return rd
+
+@pytest.fixture
+def chain(walletdb, emulator, tmp_path, monkeypatch):
+    monkeypatch.setattr(txcache, '_cache_dir', str(tmp_path / 'txcache'))
+    txcache.clear()
+
+    c = Chain()
+    for name in ('get_blockcount', 'get_blockhash', 'get_address_deltas', 'get_unspent_many'):
+        monkeypatch.setattr(eel, name, getattr(c, name))
+    monkeypatch.setattr(eel, 'get_hex_transactions', lambda txid_l: dict([(txid, c.tx_d[txid]) for txid in txid_l]))
+    monkeypatch.setattr(eel, 'get_address_txids', lambda a: [])
+    yield c
+    txcache.clear()
+
+def add_address(walletdb, index):
+    public_key, a, _ = address.derive(0, 0, index)
+    walletdb.put_address_many([{'address': a, 'public_key': public_key, 'account': 0, 'index': index, 'change': 0}])
+    return serialize.b2s(a)
+
+def outpoints(walletdb):
+    return set([(u['txid'], u['nout']) for u in walletdb.get_all_unspent()])
+
+def checkpoints(walletdb):
+    return [v[0] for v in walletdb.db_get_con().execute('SELECT height FROM sync_checkpoints ORDER BY height')]
+
+# ----*----*----*----*----*----*----*----*----*----*----*----*----*----*
+
+def test_spend_and_receive(walletdb, chain):
+    a = add_address(walletdb, 0)
+    b = add_address(walletdb, 1)
+    old = chain.pay(a, 100000)
+    chain.mine()
+    walletdb.updatedb()
+    assert outpoints(walletdb) == set([old])
+    assert checkpoints(walletdb) == [1]
+
+    chain.spend(a, old, 100000)
+    new = chain.pay(b, 60000)
+    chain.mine()
+    chain.mine()
+    walletdb.syncdb()
+
+    assert outpoints(walletdb) == set([new])
+    assert walletdb.get_balance() == 60000
+    assert checkpoints(walletdb) == [1, 3]
+    # only the blocks after the checkpoint were asked for
+    assert chain.delta_calls == [(set([a, b]), 2, 3)]
+
+def test_reorg(walletdb, chain):
+    a = add_address(walletdb, 0)
+    old = chain.pay(a, 100000)
+    chain.mine()
+    walletdb.updatedb()
+
+    lost = chain.pay(a, 30000)
+    chain.mine()
+    walletdb.syncdb()
+    chain.spend(a, old, 100000)
+    chain.mine()
+    walletdb.syncdb()
+    assert outpoints(walletdb) == set([lost])
+    assert checkpoints(walletdb) == [1, 2, 3]
+
+    # blocks 2 and 3 are replaced; 1 is the common ancestor
+    chain.reorg(1)
+    new = chain.pay(a, 40000)
+    chain.mine()
+    chain.mine()
+    chain.mine()
+    chain.delta_calls = []
+    walletdb.syncdb()
+
+    assert outpoints(walletdb) == set([old, new])
+    assert checkpoints(walletdb) == [1, 4]
+    assert chain.delta_calls == [(set([a]), 2, 4)]
+    assert walletdb.get_unspent(a.encode())[0]['script'] == serialize.b2hs(script.standard_p2pkh_pkh(energi.decode_address(a)))
+
+def test_reorg_after_newer_snapshot(walletdb, chain):
+    a = add_address(walletdb, 0)
+    old = chain.pay(a, 100000)
+    chain.mine()
+
+    # the utxos are a block newer than the checkpoint taken with them
+    lost = chain.pay(a, 30000)
+    chain.spend(a, old, 100000)
+    chain.mine()
+    chain.lag = 1
+    walletdb.updatedb()
+    chain.lag = 0
+    assert checkpoints(walletdb) == [1]
+    assert outpoints(walletdb) == set([lost])
+
+    walletdb.syncdb()
+    chain.reorg(1)
+    chain.mine()
+    chain.mine()
+    walletdb.syncdb()
+
+    assert outpoints(walletdb) == set([old])
+
+def test_journal_trimmed(walletdb, chain, monkeypatch):
+    monkeypatch.setattr(walletdb, '_sync_checkpoints', 3)
+    a = add_address(walletdb, 0)
+    walletdb.updatedb()
+
+    paid = set()
+    for _ in range(6):
+        paid.add(chain.pay(a, 1000))
+        chain.mine()
+        walletdb.syncdb()
+
+    assert outpoints(walletdb) == paid
+    assert checkpoints(walletdb) == [4, 5, 6]
+    journal = [v[0] for v in walletdb.db_get_con().execute('SELECT height FROM sync_journal ORDER BY height')]
+    assert journal == [5, 6]
+
+def test_fresh_addresses(walletdb, chain):
+    a = add_address(walletdb, 0)
+    walletdb.updatedb()
+
+    # added after the last sync: one paid before it, one never used
+    c = add_address(walletdb, 1)
+    d = add_address(walletdb, 2)
+    early = chain.pay(c, 5000)
+    chain.mine()
+    walletdb.syncdb()
+
+    assert outpoints(walletdb) == set([early])
+    assert chain.delta_calls == [(set([a]), 1, 1)]
+    addr_d = walletdb.get_address_d()
+    assert addr_d[d.encode()]['utxos'] == []
+    synced = dict(walletdb.db_get_con().execute('SELECT address, height FROM sync_addresses').fetchall())
+    assert synced[c.encode()] == synced[d.encode()] == 1
+
+    # and from now on they are synced from deltas
+    chain.pay(d, 7000)
+    chain.mine()
+    chain.delta_calls = []
+    walletdb.syncdb()
+    assert chain.delta_calls == [(set([a, c, d]), 2, 2)]
+    assert walletdb.get_balance() == 12000
+
+def test_no_checkpoint_is_a_full_update(walletdb, chain):
+    a = add_address(walletdb, 0)
+    paid = chain.pay(a, 5000)
+    chain.mine()
+    walletdb.syncdb()
+    assert outpoints(walletdb) == set([paid])
+    assert checkpoints(walletdb) == [1]
+    assert chain.delta_calls == []
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+
+import pytest
+
+
+def utxo(i, satoshis = 1000):
+    return {'txid': '%064x' % i, 'outputIndex': i % 3, 'script': '76a9', 'satoshis': satoshis}
+
+def test_migrate_version_0_with_duplicates(walletdb):
+    # a wallet.db as the first create_db() made it, with an outpoint
+    # stored twice in unspent and in locked
+    os.makedirs(os.path.expanduser(walletdb._db_dir), exist_ok = True)
+    con = sqlite3.connect(walletdb._db_file())
+    con.execute('CREATE TABLE wallet(address TEXT PRIMARY KEY, pubkey TEXT, pkh TEXT, watchonly INT, ismasternode INT, account INT, path_index INT, change INT)')
+    con.execute('CREATE TABLE unspent(address TEXT, txid TEXT, nout INT, script TEXT, satoshis INT)')
+    con.execute('CREATE TABLE locked(txid TEXT, nout INT)')
+    con.execute("INSERT INTO wallet VALUES('A', '', '', 1, 0, 0, 0, 0)")
+    con.executemany('INSERT INTO unspent VALUES(?, ?, ?, ?, ?)', [('A', 'aa' * 32, 0, '', 100), ('A', 'aa' * 32, 0, '', 100), ('A', 'aa' * 32, 1, '', 50)])
+    con.executemany('INSERT INTO locked VALUES(?, ?)', [('aa' * 32, 0), ('aa' * 32, 0)])
+    con.commit()
+    con.close()
+
+    con = walletdb.db_get_con()
+    assert walletdb.get_db_version(con) == len(walletdb._migrations)
+    assert sorted([(u['txid'], u['nout']) for u in walletdb.get_all_unspent()]) == [('aa' * 32, 0), ('aa' * 32, 1)]
+    assert walletdb.get_locked_set() == set([('aa' * 32, 0)])
+    assert walletdb.get_balance() == 150
+
+    # the unique indexes are in place
+    with pytest.raises(sqlite3.IntegrityError):
+        con.execute("INSERT INTO locked VALUES(?, 0)", ('aa' * 32,))
+
+    # and opening it again changes nothing
+    walletdb.db_close()
+    assert walletdb.get_db_version(walletdb.db_get_con()) == len(walletdb._migrations)
+    assert len(walletdb.get_all_unspent()) == 2
+
+def test_newer_version_refused(walletdb):
+    walletdb.db_get_con().execute('PRAGMA user_version = %d' % (len(walletdb._migrations) + 1))
+    walletdb.db_close()
+    with pytest.raises(RuntimeError, match = 'newer'):
+        walletdb.db_get_con()
+
+def test_replace_unspent_for_addresses(walletdb):
+    walletdb.put_unspent_many([dict(utxo(i), address = a) for i, a in enumerate(('A', 'A', 'B', 'C'))])
+
+    # A's rows are replaced, B loses its only one, C is left alone
+    walletdb.replace_unspent_for_addresses({'A': [utxo(1), utxo(10)], 'B': []})
+    assert sorted([(u['address'], u['txid'], u['nout']) for u in walletdb.get_all_unspent()]) == \
+        [('A', '%064x' % 1, 1), ('A', '%064x' % 10, 1), ('C', '%064x' % 3, 0)]
+
+    # writing a row again replaces it
+    walletdb.put_unspent_many([dict(utxo(10, satoshis = 5), address = 'A')])
+    assert [u['satoshis'] for u in walletdb.get_unspent('A') if u['txid'] == '%064x' % 10] == [5]
+
+def test_get_address_d_and_balance(walletdb):
+    for i, a in enumerate(('A', 'B', 'C')):
+        walletdb.put_address_db(a, index = i)
+    walletdb.put_unspent_many([dict(utxo(i, satoshis = 1000 + i), address = a) for i, a in enumerate(('A', 'A', 'C', 'A'))])
+    # not one of ours; counts for neither
+    walletdb.put_unspent_many([dict(utxo(9), address = 'X')])
+
+    addr_d = walletdb.get_address_d()
+    assert list(addr_d) == ['A', 'B', 'C']
+    assert [u['txid'] for u in addr_d['A']['utxos']] == ['%064x' % i for i in (0, 1, 3)]
+    assert addr_d['B']['utxos'] == []
+    assert addr_d['B']['index'] == 1
+    assert [u['satoshis'] for u in addr_d['C']['utxos']] == [1002]
+
+    assert walletdb.get_balance() == sum([u['satoshis'] for a in addr_d for u in addr_d[a]['utxos']]) == 4006
+
+    ae = walletdb.get_addr_txid('%064x' % 3, 0)
+    assert ae['address'] == 'A'
+    assert len(ae['utxos']) == 3
+    assert walletdb.get_addr_txid('%064x' % 9, 0) is None
+
+def test_empty_balance(walletdb):
+    walletdb.put_address_db('A')
+    assert walletdb.get_balance() == 0
+    assert walletdb.get_address_d()['A']['utxos'] == []
+
+def test_remove_locked(walletdb):
+    for a in ('A', 'B'):
+        walletdb.put_address_db(a)
+    walletdb.put_unspent_many([dict(utxo(i), address = a) for i, a in enumerate(('A', 'A', 'B', 'B', 'B'))])
+    walletdb.lock_txid('%064x' % 1, 1)
+    walletdb.lock_txid('%064x' % 3, 0)
+    # only that output of the transaction is locked
+    walletdb.lock_txid('%064x' % 4, 0)
+    assert walletdb.get_locked_set() == set([('%064x' % 1, 1), ('%064x' % 3, 0), ('%064x' % 4, 0)])
+
+    addr_d = walletdb.remove_locked(walletdb.get_address_d())
+    assert [u['txid'] for u in addr_d['A']['utxos']] == ['%064x' % 0]
+    assert [u['txid'] for u in addr_d['B']['utxos']] == ['%064x' % 2, '%064x' % 4]
+
+    # at most max_inputs are kept, locked ones not counting
+    addr_d = walletdb.remove_locked(walletdb.get_address_d(), max_inputs = 2)
+    assert [u['txid'] for a in addr_d for u in addr_d[a]['utxos']] == ['%064x' % 0, '%064x' % 2]
+
+    walletdb.unlock_txid('%064x' % 1, 1)
+    assert len(walletdb.remove_locked(walletdb.get_address_d())['A']['utxos']) == 2